@@ -3,11 +3,18 @@ Frozen determinism configuration for all Gemini model calls.
 
 This ensures consistent, reproducible results across all LLM interactions.
 """
-import os
+import subprocess
 
 # Model version tracking
 MODEL_NAME = "gemini-2.5-flash-lite"
-PROMPT_VERSION = os.popen("git rev-parse --short HEAD 2>nul").read().strip() or "dev"
+# stderr is captured rather than shell-redirected: "2>nul" only discards it on Windows and
+# creates a stray "nul" file everywhere else
+try:
+    PROMPT_VERSION = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip() or "dev"
+except OSError:
+    PROMPT_VERSION = "dev"
 
 # Deterministic generation config
 # Temperature near-zero for minimal randomness
@@ -1,23 +1,68 @@
 import json
 import re
-from typing import TypeVar, Type, Tuple
+from typing import Any, TypeVar, Type, Tuple
+import jiter
 from pydantic import BaseModel, ValidationError
+from .tool_runner import _send_message
 
 T = TypeVar('T', bound=BaseModel)
 
 
+def loads_json(text: str) -> Any:
+    """
+    Parse JSON text with jiter, falling back to json.loads when jiter rejects it.
+
+    The fallback re-raises the stdlib json.JSONDecodeError (with its message), so
+    callers keep handling the same exception type as before.
+    """
+    try:
+        return jiter.from_json(text.encode())
+    except (ValueError, AttributeError):
+        return json.loads(text)
+
+
+def loads_json_or_repair(text: str) -> Any:
+    """
+    Parse JSON text, retrying once on the _attempt_json_repair() output (code fences,
+    surrounding prose, trailing commas) when the raw text is not valid JSON.
+
+    Used for replies from tool-enabled sessions, where JSON mode is unavailable.
+    """
+    try:
+        return loads_json(text)
+    except json.JSONDecodeError:
+        return loads_json(_attempt_json_repair(text))
+
+
 def parse_or_repair_json(text: str, model: Type[T]) -> Tuple[T | None, list[str]]:
     """
     Attempts to parse JSON from text and validate against a pydantic model.
     Returns (parsed_model, errors) where parsed_model is None if parsing failed.
     """
+    # Fast path: the model's compiled validator parses and validates the JSON in one pass
+    try:
+        return model.model_validate_json(text), []
+    except ValidationError:
+        pass
+
+    parsed_model, errors, _ = parse_or_repair_json_with_dict(text, model)
+    return parsed_model, errors
+
+
+def parse_or_repair_json_with_dict(text: str, model: Type[T]) -> Tuple[T | None, list[str], Any]:
+    """
+    Same as parse_or_repair_json, but also returns the data decoded directly from text.
+    Returns (parsed_model, errors, raw_data) where raw_data is None if text itself is not
+    valid JSON, so callers can keep the raw LLM output without parsing it a second time.
+    """
     errors = []
+    raw_data = None
 
     # Try direct parsing first
     try:
-        data = json.loads(text)
-        parsed_model = model(**data)
-        return parsed_model, []
+        data = raw_data = loads_json(text)
+        parsed_model = model.model_validate(data)
+        return parsed_model, [], raw_data
     except json.JSONDecodeError as e:
         errors.append(f"JSON decode error: {e}")
     except ValidationError as e:
@@ -29,9 +74,9 @@ def parse_or_repair_json(text: str, model: Type[T]) -> Tuple[T | None, list[str]
     cleaned_text = _attempt_json_repair(text)
     if cleaned_text != text:
         try:
-            data = json.loads(cleaned_text)
-            parsed_model = model(**data)
-            return parsed_model, []
+            data = loads_json(cleaned_text)
+            parsed_model = model.model_validate(data)
+            return parsed_model, [], raw_data
         except json.JSONDecodeError as e:
             errors.append(f"JSON decode error after repair: {e}")
         except ValidationError as e:
@@ -39,7 +84,7 @@ def parse_or_repair_json(text: str, model: Type[T]) -> Tuple[T | None, list[str]
         except Exception as e:
             errors.append(f"Unexpected error after repair: {e}")
 
-    return None, errors
+    return None, errors, raw_data
 
 
 def _attempt_json_repair(text: str) -> str:
@@ -99,7 +144,8 @@ You MUST respond with ONLY a single, valid JSON object. No other text.
 Please retry the request and provide ONLY the JSON response.
 """
 
-    response = chat.send_message(hardener_prompt + "\n\n" + last_prompt)
+    # Goes through the shared LLM concurrency slots like every other Gemini request
+    response = _send_message(chat, hardener_prompt + "\n\n" + last_prompt)
 
     # Guard against finish_reason=1 or missing text Part
     try:
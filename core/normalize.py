@@ -5,6 +5,7 @@ Reduces LLM surface area by handling common variations in code instead of prompt
 """
 import re
 import unicodedata
+from functools import lru_cache
 from typing import Optional
 
 
@@ -159,6 +160,7 @@ def apply_multilingual_aliases(name: str) -> str:
     return result if result != name_lower else name
 
 
+@lru_cache(maxsize=4096)
 def canonicalize_portion_label(portion_label: Optional[str]) -> Optional[str]:
     """
     Normalize portion labels to canonical forms.
@@ -182,6 +184,7 @@ def canonicalize_portion_label(portion_label: Optional[str]) -> Optional[str]:
     return label_lower
 
 
+@lru_cache(maxsize=4096)
 def categorize_food(name: str) -> Optional[str]:
     """
     Categorize food by type for portion resolution.
@@ -237,8 +240,22 @@ def canonicalize_name(name: str, brand: Optional[str] = None, category: Optional
     if not name:
         return name
 
-    original_name = name
+    name_translated, name_canonical = _canonicalize_name_cached(name, brand, category)
 
+    if name_translated != name:
+        print(f"DEBUG: Multilingual canonicalization: '{name}' → '{name_translated}' (before USDA search)")
+
+    return name_canonical
+
+
+@lru_cache(maxsize=4096)
+def _canonicalize_name_cached(name: str, brand: Optional[str], category: Optional[str]) -> tuple[str, str]:
+    """
+    Memoized body of canonicalize_name(); logging stays in the caller so it runs every time.
+
+    Returns:
+        Tuple of (multilingual-translated name, canonicalized name)
+    """
     # Step 1: Transliterate to ASCII (handles "café" -> "cafe")
     name_ascii = transliterate_to_ascii(name)
 
@@ -248,9 +265,6 @@ def canonicalize_name(name: str, brand: Optional[str] = None, category: Optional
 
     name_lower = name_translated.lower().strip()
 
-    if name_translated != original_name:
-        print(f"DEBUG: Multilingual canonicalization: '{original_name}' → '{name_translated}' (before USDA search)")
-
     # Step 3: Apply context-aware aliases
     if brand and "mcdonald" in brand.lower():
         # In McDonald's context, "chips" means fries (UK English)
@@ -263,7 +277,7 @@ def canonicalize_name(name: str, brand: Optional[str] = None, category: Optional
             name_lower = canonical
             break
 
-    return name_lower
+    return name_translated, name_lower
 
 
 def check_exclusion_conflict(query: str, candidate_description: str) -> bool:
@@ -3,10 +3,17 @@ try:
     from typing import NotRequired
 except ImportError:
     from typing_extensions import NotRequired
+from concurrent.futures import ThreadPoolExecutor
 from integrations import usda_client, normalize
+from config.privacy import is_production
+import json
 import re
 
 
+# Per-item scaling DEBUG lines echo raw food names and run once per ingredient, so they are dev-only
+_DEBUG_PER_ITEM = not is_production()
+
+
 def _passes_critical_nutrition(name_lower: str, per100g: Dict[str, float]) -> bool:
     """
     Check if nutrition data makes sense given critical modifiers in the name.
@@ -66,6 +73,11 @@ def _passes_critical_nutrition(name_lower: str, per100g: Dict[str, float]) -> bo
     return True
 
 
+# Variant keywords tried in order; the first one found in the name is moved to the front
+_VARIANT_KEYWORDS = ('diet', 'zero', 'sugar-free', 'sugar free', 'no sugar', 'unsweetened',
+                     'nonfat', 'fat free', 'skim', '1%', '2%', 'whole')
+
+
 def _retry_with_variant_forward(name: str) -> Optional[Dict]:
     """
     Retry USDA search with variant keyword moved to front.
@@ -78,10 +90,8 @@ def _retry_with_variant_forward(name: str) -> Optional[Dict]:
         USDA match or None
     """
     name_lower = name.lower()
-    variant_keywords = ['diet', 'zero', 'sugar-free', 'sugar free', 'no sugar', 'unsweetened',
-                        'nonfat', 'fat free', 'skim', '1%', '2%', 'whole']
 
-    for kw in variant_keywords:
+    for kw in _VARIANT_KEYWORDS:
         if kw in name_lower:
             # Extract base name (remove parentheses and variant)
             base = re.sub(r'\([^)]*\)', '', name).strip()
@@ -126,6 +136,9 @@ GROUNDING_POLICY = {
     "allow_fallback_zeroes": True
 }
 
+# Grounding is dominated by USDA/web round-trips, so ingredients are looked up concurrently
+GROUNDING_MAX_WORKERS = 8
+
 
 def normalize_and_ground(name: str, search_fn=None) -> tuple[GroundedItem, int]:
     """
@@ -179,7 +192,6 @@ def normalize_and_ground(name: str, search_fn=None) -> tuple[GroundedItem, int]:
 
             # Comprehensive nutrition sanity check
             if not _passes_critical_nutrition(name.lower(), macros):
-                import json
                 print(f"METRICS: {json.dumps({'event': 'sanity_gate_fail', 'ingredient': name, 'matched': usda_match.get('description'), 'macros': macros})}")
                 print(f"WARNING: Nutrition sanity check failed for '{name}'")
                 print(f"WARNING: Matched: {usda_match.get('description', 'N/A')}")
@@ -266,15 +278,18 @@ def scale_item(grounded: GroundedItem, grams: float) -> ScaledItem:
     try:
         # Calculate scaling factor (grams / 100)
         scale_factor = grams / 100.0
-        print(f"DEBUG: Scaling '{grounded['name']}' from {grounded['per100g']['kcal']} kcal/100g to {grams}g (factor: {scale_factor})")
+        per100g = grounded["per100g"]
+        if _DEBUG_PER_ITEM:
+            print(f"DEBUG: Scaling '{grounded['name']}' from {per100g['kcal']} kcal/100g to {grams}g (factor: {scale_factor})")
 
         # Scale macros (round internally to 2 decimals for consistency)
-        scaled_kcal = round(grounded["per100g"]["kcal"] * scale_factor, 2)
-        scaled_protein = round(grounded["per100g"]["protein_g"] * scale_factor, 2)
-        scaled_carb = round(grounded["per100g"]["carb_g"] * scale_factor, 2)
-        scaled_fat = round(grounded["per100g"]["fat_g"] * scale_factor, 2)
+        scaled_kcal = round(per100g["kcal"] * scale_factor, 2)
+        scaled_protein = round(per100g["protein_g"] * scale_factor, 2)
+        scaled_carb = round(per100g["carb_g"] * scale_factor, 2)
+        scaled_fat = round(per100g["fat_g"] * scale_factor, 2)
 
-        print(f"DEBUG: Scaled macros for '{grounded['name']}': {scaled_kcal} kcal, {scaled_protein}g protein, {scaled_carb}g carbs, {scaled_fat}g fat")
+        if _DEBUG_PER_ITEM:
+            print(f"DEBUG: Scaled macros for '{grounded['name']}': {scaled_kcal} kcal, {scaled_protein}g protein, {scaled_carb}g carbs, {scaled_fat}g fat")
 
         scaled_item = ScaledItem(
             name=grounded["name"],
@@ -359,6 +374,9 @@ def ground_ingredients_list(ingredients: List[Dict], search_fn=None) -> tuple[Li
     """
     Ground a list of ingredients with USDA data.
 
+    Lookups run on a thread pool (up to GROUNDING_MAX_WORKERS), so search_fn must be safe
+    to call from several threads. Results keep the order of ingredients.
+
     Args:
         ingredients: List of ingredient dicts with 'name' and 'amount' fields
         search_fn: Optional search function for web-assisted normalization
@@ -366,18 +384,13 @@ def ground_ingredients_list(ingredients: List[Dict], search_fn=None) -> tuple[Li
     Returns:
         Tuple of (List of GroundedItem objects, total_tool_calls_count)
     """
-    grounded_items = []
-    total_tool_calls = 0
-
-    for ingredient in ingredients:
+    def ground_one(ingredient: Dict) -> tuple[Optional[GroundedItem], int]:
         try:
             name = ingredient.get('name', '')
             if name:
-                grounded, tool_calls = normalize_and_ground(name, search_fn)
-                grounded_items.append(grounded)
-                total_tool_calls += tool_calls
-            else:
-                print(f"Skipping ingredient with missing name: {ingredient}")
+                return normalize_and_ground(name, search_fn)
+            print(f"Skipping ingredient with missing name: {ingredient}")
+            return None, 0
         except Exception as e:
             print(f"Error grounding ingredient {ingredient}: {e}")
             # Add fallback item
@@ -388,7 +401,16 @@ def ground_ingredients_list(ingredients: List[Dict], search_fn=None) -> tuple[Li
                 source="fallback",
                 per100g={"kcal": 0.0, "protein_g": 0.0, "carb_g": 0.0, "fat_g": 0.0}
             )
-            grounded_items.append(fallback)
+            return fallback, 0
+
+    if len(ingredients) > 1:
+        with ThreadPoolExecutor(max_workers=min(GROUNDING_MAX_WORKERS, len(ingredients))) as executor:
+            results = list(executor.map(ground_one, ingredients))
+    else:
+        results = [ground_one(ingredient) for ingredient in ingredients]
+
+    grounded_items = [grounded for grounded, _ in results if grounded is not None]
+    total_tool_calls = sum(tool_calls for _, tool_calls in results)
 
     return grounded_items, total_tool_calls
 
@@ -11,6 +11,7 @@ Resolution order (high to low trust):
 """
 
 from typing import Dict, List, Optional, Any
+import json
 import re
 
 
@@ -285,6 +286,18 @@ def _category_heuristics(name: str, notes: str, portion_label: str = "") -> Opti
     return None
 
 
+# Portion label patterns, compiled once (each label is parsed per ingredient per calculation)
+_KG_RE = re.compile(r'(\d+(?:\.\d+)?)\s*kg')
+_GRAMS_RE = re.compile(r'(\d+(?:\.\d+)?)\s*g(?:rams?)?(?:\s|$)')
+_LITERS_RE = re.compile(r'(\d+(?:\.\d+)?)\s*l(?:iters?)?(?:\s|$)')
+_ML_RE = re.compile(r'(\d+(?:\.\d+)?)\s*ml')
+_OZ_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:fl\s*)?oz')
+_SCOOPS_RE = re.compile(r'(\d+)\s*scoops?')
+_TBSP_RE = re.compile(r'(\d+)\s*(?:tbsp|tablespoons?|tbs)')
+# Pattern: number + optional space + countable unit
+_COUNTABLE_RE = re.compile(r'(\d+)\s*(piece|pieces|slice|slices|nugget|nuggets|wing|wings|roll|rolls|item|items|count)\b')
+
+
 def _extract_grams_from_label(portion_label: str) -> Optional[float]:
     """
     Extract grams from portion_label like '300g', '250 grams', '1.5kg'.
@@ -298,12 +311,12 @@ def _extract_grams_from_label(portion_label: str) -> Optional[float]:
     label_lower = portion_label.lower()
 
     # Match kg first (convert to grams)
-    kg_match = re.search(r'(\d+(?:\.\d+)?)\s*kg', label_lower)
+    kg_match = _KG_RE.search(label_lower)
     if kg_match:
         return float(kg_match.group(1)) * 1000.0
 
     # Match grams
-    g_match = re.search(r'(\d+(?:\.\d+)?)\s*g(?:rams?)?(?:\s|$)', label_lower)
+    g_match = _GRAMS_RE.search(label_lower)
     if g_match:
         return float(g_match.group(1))
 
@@ -323,12 +336,12 @@ def _extract_ml_from_label(portion_label: str) -> Optional[float]:
     label_lower = portion_label.lower()
 
     # Match liters first (convert to mL)
-    l_match = re.search(r'(\d+(?:\.\d+)?)\s*l(?:iters?)?(?:\s|$)', label_lower)
+    l_match = _LITERS_RE.search(label_lower)
     if l_match:
         return float(l_match.group(1)) * 1000.0
 
     # Match milliliters
-    ml_match = re.search(r'(\d+(?:\.\d+)?)\s*ml', label_lower)
+    ml_match = _ML_RE.search(label_lower)
     if ml_match:
         return float(ml_match.group(1))
 
@@ -346,7 +359,7 @@ def _extract_oz_from_label(portion_label: str) -> Optional[float]:
         return None
 
     # Match patterns like "14 oz", "16oz", "12 fl oz"
-    match = re.search(r'(\d+(?:\.\d+)?)\s*(?:fl\s*)?oz', portion_label.lower())
+    match = _OZ_RE.search(portion_label.lower())
     if match:
         return float(match.group(1))
     return None
@@ -363,7 +376,7 @@ def _extract_scoops_from_label(portion_label: str) -> Optional[int]:
         return None
 
     # Match patterns like "1 scoop", "2 scoops"
-    match = re.search(r'(\d+)\s*scoops?', portion_label.lower())
+    match = _SCOOPS_RE.search(portion_label.lower())
     if match:
         return int(match.group(1))
     return None
@@ -380,7 +393,7 @@ def _extract_tbsp_from_label(portion_label: str) -> Optional[int]:
         return None
 
     # Match patterns like "2 tbsp", "1 tablespoon", "3 tablespoons"
-    match = re.search(r'(\d+)\s*(?:tbsp|tablespoons?|tbs)', portion_label.lower())
+    match = _TBSP_RE.search(portion_label.lower())
     if match:
         return int(match.group(1))
     return None
@@ -619,8 +632,7 @@ def extract_countable_pattern(portion_label: str) -> Optional[tuple[int, str]]:
         return None
 
     # Pattern: number + optional space + countable unit
-    pattern = r'(\d+)\s*(piece|pieces|slice|slices|nugget|nuggets|wing|wings|roll|rolls|item|items|count)\b'
-    match = re.search(pattern, portion_label.lower())
+    match = _COUNTABLE_RE.search(portion_label.lower())
 
     if match:
         count = int(match.group(1))
@@ -671,8 +683,6 @@ def resolve_portions(items: List[Dict[str, Any]], usda_client=None) -> tuple[Lis
     Returns:
         Tuple of (updated items list with resolved grams, metrics dict with tier counts)
     """
-    import json
-
     out = []
     metrics = {
         "user_vision": 0,
@@ -921,7 +931,6 @@ def resolve_portions(items: List[Dict[str, Any]], usda_client=None) -> tuple[Lis
         out.append(item)
 
     # Log metrics summary as JSON for easy parsing
-    import json
     total_items = sum(metrics.values())
     tier_rates = {tier: (count / total_items) * 100 if total_items > 0 else 0 for tier, count in metrics.items()}
 
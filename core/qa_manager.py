@@ -1,22 +1,36 @@
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import hashlib
 import json
-from typing import List, Dict, Any
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import List, Dict, Any, TypedDict
+try:
+    from typing import NotRequired
+except ImportError:
+    from typing_extensions import NotRequired
 from .schemas import RefinementUpdate, VisionEstimate, Explanation
-from .json_repair import parse_or_repair_json, llm_retry_with_system_hardener
+from .normalize import normalize_for_matching, canonicalize_name, canonicalize_portion_label, categorize_food
+from .json_repair import parse_or_repair_json, parse_or_repair_json_with_dict, llm_retry_with_system_hardener, loads_json_or_repair
 from .tool_runner import run_with_tools
 from .nutrition_lookup import build_deterministic_breakdown
 from .validators import run_all_validations
 from .portion_resolver import resolve_portions
+from .stage2_cache import compute_portions_signature, get_cached_stage2_edit, cache_stage2_edit
+from .refine_cache import REFINE_CACHE_ENABLED, compute_history_signature, get_cached_refinement, cache_refinement
+from config.privacy import is_production
 
+# Per-ingredient/per-edit DEBUG lines and raw LLM response dumps scale with the meal and echo raw
+# food names, so they are dev-only (LOG_LEVEL=prod skips their formatting and writes).
+# Summary DEBUG and METRICS lines always print.
+_DEBUG_PER_ITEM = not is_production()
 
-def load_qa_prompt() -> str:
-    """Load the QA manager prompt template."""
-    try:
-        with open("config/llm_prompts/qa_manager_prompt.txt", "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        # Fallback prompt if file not found
-        return """
+
+# Used when config/llm_prompts/qa_manager_prompt.txt is missing
+_FALLBACK_QA_PROMPT = """
 You are Nutri-AI's refinement module. Based on the conversation context and user's clarifications, update the meal estimate.
 
 IMPORTANT: If the user mentions branded/restaurant/fast-food items, first call `perform_web_search` with a precise query like '<brand> <item> nutrition facts' and use those results.
@@ -44,6 +58,138 @@ Required JSON Output Format:
 }
 """
 
+# Sent when the first refinement response could not be parsed (tool-enabled path)
+_HARDENER_PROMPT = """
+CRITICAL: Your previous response had JSON parsing errors.
+You MUST respond with ONLY a single, valid JSON object. No other text.
+- No markdown code blocks
+- No trailing commas
+- No comments
+- No prose before or after the JSON
+Please retry the request and provide ONLY the JSON response.
+"""
+
+# Final-turn explanation request; %s is the compact JSON breakdown (macros are already final)
+_EXPLANATION_PROMPT_TEMPLATE = """
+Based on our conversation, I've calculated the nutritional breakdown using USDA data. Here are the results:
+
+%s
+
+Please provide a brief explanation of the assumptions made and suggest one follow-up question if there are any uncertainties.
+Do NOT recalculate or modify any nutritional values - they are final.
+
+Respond with ONLY a JSON object:
+{
+  "explanation": "brief explanation of assumptions",
+  "follow_up_question": "optional question for user"
+}
+"""
+
+
+@lru_cache(maxsize=1)
+def load_qa_prompt() -> str:
+    """Load the QA manager prompt template (read once per process)."""
+    try:
+        with open("config/llm_prompts/qa_manager_prompt.txt", "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        # Fallback prompt if file not found
+        return _FALLBACK_QA_PROMPT
+
+
+# Base delay (seconds) for jittered exponential backoff between LLM retries
+_LLM_RETRY_BASE_DELAY = 0.1
+
+
+def _backoff_sleep(attempt: int, base: float = _LLM_RETRY_BASE_DELAY) -> None:
+    """
+    Sleep before retrying an LLM call: base * 2**attempt seconds, randomized by ±50%.
+
+    The jitter keeps concurrent sessions from retrying in lockstep when the API is under load.
+    """
+    time.sleep(base * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+# Provider errors worth retrying: rate limiting (429, incl. ResourceExhausted) and transient
+# server-side failures. Auth and bad-request errors are not retried.
+_TRANSIENT_LLM_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+def _retry_with_backoff(fn, attempts: int = 2, base: float = _LLM_RETRY_BASE_DELAY,
+                        retry_on: tuple = (ValueError,) + _TRANSIENT_LLM_ERRORS):
+    """
+    Call fn(), retrying with jittered backoff when it raises one of retry_on.
+
+    run_with_tools() raises ValueError when the LLM returns an empty response; the
+    provider raises _TRANSIENT_LLM_ERRORS when rate limited or briefly unavailable.
+
+    Args:
+        fn: Zero-argument callable performing the LLM call
+        attempts: Total number of attempts
+        base: Base backoff delay in seconds
+        retry_on: Exception types that trigger a retry (anything else propagates at once)
+
+    Returns:
+        Whatever fn() returns; the last error is re-raised if all attempts fail
+    """
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt == attempts - 1:
+                raise
+            print(f"WARNING: LLM call failed (attempt {attempt + 1}/{attempts}): {e}, retrying with backoff")
+            _backoff_sleep(attempt, base)
+
+
+# Model turn recorded after the seeded QA prompt. A neutral acknowledgement rather than a
+# sample update, so the history does not suggest "no change" as the expected reply.
+_QA_PROMPT_ACK = "Understood. I will reply to each refinement turn with a single JSON object in the required format."
+
+
+def _first_part_text(content: Any) -> str | None:
+    """Return the text of the first part of a history entry (Content object or {"role", "parts"} dict)."""
+    parts = content.get("parts") if isinstance(content, dict) else getattr(content, "parts", None)
+    if not parts:
+        return None
+    part = parts[0]
+    return part if isinstance(part, str) else getattr(part, "text", None)
+
+
+def init_chat_session(chat_session: genai.ChatSession, base_prompt: str | None = None) -> None:
+    """
+    Seed the chat history with the static QA prompt, once per session.
+
+    refine() then sends only the per-turn context and answers, so the large
+    instruction block stays a fixed prefix of every request instead of being
+    re-sent (and re-processed) on each turn. Whether a session is already seeded
+    is read from its history, so nothing is stored on the SDK object.
+
+    Args:
+        chat_session: Chat session used for refinement turns
+        base_prompt: Prompt to seed (defaults to load_qa_prompt())
+    """
+    history = chat_session.history
+    if not isinstance(history, list):
+        # History not readable (e.g. a stub session) - leave it untouched
+        return
+
+    if base_prompt is None:
+        base_prompt = load_qa_prompt()
+
+    if history and _first_part_text(history[0]) == base_prompt:
+        return
+
+    chat_session.history = [
+        {"role": "user", "parts": [base_prompt]},
+        {"role": "model", "parts": [_QA_PROMPT_ACK]},
+    ] + history
+
 
 # Decomposition logic removed - LLM handles all ingredient decomposition via QA prompts
 
@@ -55,16 +201,23 @@ def refine(context: str, user_input: str | dict, chat_session: genai.ChatSession
     Args:
         context: Context from the previous conversation
         user_input: Either a dict[question_id, answer] for structured answers,
-                   or a string for free-form clarifications (backward compat)
+                   or a string for free-form clarifications (backward compat).
+                   An empty dict (all questions skipped) returns a no-change
+                   update without calling the LLM.
         chat_session: Active chat session with conversation history
         available_tools: Dict mapping tool names to functions for search, etc.
 
     Returns:
         Tuple of (RefinementUpdate object or None if parsing failed, tool_calls_count)
     """
+    if isinstance(user_input, dict) and not user_input:
+        # Nothing to refine - skip the LLM round-trip entirely
+        print(f"DEBUG: refine() called with no answers, returning no-change update")
+        return RefinementUpdate(updated_ingredients=[], updated_assumptions=[]), 0
+
     if isinstance(user_input, dict):
         print(f"DEBUG: refine() called with structured answers: {user_input}")
-        answers_json = json.dumps(user_input, indent=2)
+        answers_json = json.dumps(user_input, separators=(',', ':'))
         input_text = f"User provided these answers to critical questions:\n{answers_json}"
     else:
         # Free-form text is only allowed when there are no critical questions
@@ -74,31 +227,49 @@ def refine(context: str, user_input: str | dict, chat_session: genai.ChatSession
         input_text = f"User input: {user_input}"
 
     try:
-        # Load prompt template
-        base_prompt = load_qa_prompt()
+        # Static instructions live in the session history; only the delta is sent per turn
+        init_chat_session(chat_session)
 
         # Construct refinement prompt with context
         full_prompt = f"""
-{base_prompt}
-
 Context from conversation: {context}
 {input_text}
 
 Based on this information, provide the JSON response with any updates to ingredients or assumptions.
 """
 
-        print(f"DEBUG: Sending refinement prompt to LLM (FIX D: tools disabled for Stage-1)")
+        # The same turn on the same history reuses the earlier response (opt-in)
+        history_signature = compute_history_signature(chat_session.history) if REFINE_CACHE_ENABLED else None
+        cached_response = get_cached_refinement(full_prompt, history_signature) if history_signature else None
+        cacheable = False
 
-        # FIX D: Disable tools for Stage-1 to prevent empty response failures
-        # Stage-1 should be JSON-only, no web search needed
-        # Send message to chat session WITHOUT tool support for reliability
         try:
-            response_text, tool_calls_count = run_with_tools(chat_session, {}, full_prompt)  # Empty tools dict
+            if cached_response:
+                response_text, tool_calls_count = cached_response, 0
+                # Record the turn so later turns see the same conversation as after a live call
+                chat_session.history = list(chat_session.history) + [
+                    {"role": "user", "parts": [full_prompt]},
+                    {"role": "model", "parts": [response_text]},
+                ]
+            else:
+                print(f"DEBUG: Sending refinement prompt to LLM (FIX D: tools disabled for Stage-1)")
+
+                # FIX D: Disable tools for Stage-1 to prevent empty response failures
+                # Stage-1 should be JSON-only, no web search needed
+                # Send message to chat session WITHOUT tool support for reliability
+                # Rate limits are retried here; an empty response takes the simpler-prompt path below
+                response_text, tool_calls_count = _retry_with_backoff(
+                    lambda: run_with_tools(chat_session, {}, full_prompt),  # Empty tools dict
+                    attempts=3,
+                    retry_on=_TRANSIENT_LLM_ERRORS
+                )
+                cacheable = history_signature is not None
         except ValueError as e:
             # LLM returned empty response - retry once with minimal JSON-only prompt
             print(f"ERROR: LLM returned empty response on first attempt: {e}")
             print(f"METRICS: {json.dumps({'event': 'qa_stage1_empty', 'attempt': 1})}")
             print(f"DEBUG: Retrying QA refinement with simpler JSON-only prompt")
+            _backoff_sleep(0)
             retry_prompt = f"""
 User answers: {input_text}
 
@@ -119,27 +290,19 @@ Return ONLY valid JSON (no tools, no prose). Include updated ingredients list:
                 return RefinementUpdate(updated_ingredients=[], updated_assumptions=[]), 0
 
         print(f"DEBUG: LLM response received, length: {len(response_text)} chars")
-        print(f"DEBUG: LLM response text: {response_text[:500]}...")
+        if _DEBUG_PER_ITEM:
+            print(f"DEBUG: LLM response text: {response_text[:500]}...")
 
         # Parse and validate response
         print(f"DEBUG: Attempting to parse refinement JSON")
-        parsed_update, errors = parse_or_repair_json(response_text, RefinementUpdate)
+        parsed_update, errors, raw_data = parse_or_repair_json_with_dict(response_text, RefinementUpdate)
 
         if parsed_update is None and errors:
             # Attempt retry with hardener
             print(f"ERROR: Initial parsing failed: {errors}")
             print(f"DEBUG: Attempting retry with hardener")
             if available_tools:
-                hardener_prompt = """
-CRITICAL: Your previous response had JSON parsing errors.
-You MUST respond with ONLY a single, valid JSON object. No other text.
-- No markdown code blocks
-- No trailing commas
-- No comments
-- No prose before or after the JSON
-Please retry the request and provide ONLY the JSON response.
-"""
-                retry_response, retry_tool_calls = run_with_tools(chat_session, available_tools, hardener_prompt)
+                retry_response, retry_tool_calls = run_with_tools(chat_session, available_tools, _HARDENER_PROMPT)
                 tool_calls_count += retry_tool_calls
             else:
                 retry_response = llm_retry_with_system_hardener(chat_session, full_prompt, errors)
@@ -147,29 +310,32 @@ Please retry the request and provide ONLY the JSON response.
 
             if parsed_update is None:
                 print(f"ERROR: Retry parsing also failed: {retry_errors}")
-                print(f"DEBUG: Retry response was: {retry_response[:500]}...")
+                if _DEBUG_PER_ITEM:
+                    print(f"DEBUG: Retry response was: {retry_response[:500]}...")
                 print(f"Raw response: {retry_response}")
                 return None, tool_calls_count
+        elif cacheable:
+            # Only first-try responses to full_prompt are reused; repaired ones needed a retry
+            cache_refinement(full_prompt, history_signature, response_text)
 
         # Store raw model response for debugging
         if parsed_update:
-            try:
-                parsed_update.raw_model = json.loads(response_text)
-            except:
-                parsed_update.raw_model = {"raw_text": response_text}
+            # Reuse the data decoded from the first response instead of parsing it again
+            parsed_update.raw_model = raw_data if isinstance(raw_data, dict) else {"raw_text": response_text}
 
             print(f"DEBUG: Successfully parsed refinement")
             print(f"DEBUG: Updated ingredients: {len(parsed_update.updated_ingredients)}")
 
             # Enforce amount/source contract before returning
-            for ing in parsed_update.updated_ingredients:
-                # Validation is already done by Pydantic validator in schemas.py
-                # Just log for debugging
-                if ing.amount is not None:
-                    print(f"DEBUG:   - {ing.name}: {ing.amount}g (source: {ing.source})")
-                else:
-                    portion_info = f" [{ing.portion_label}]" if ing.portion_label else ""
-                    print(f"DEBUG:   - {ing.name}: portion_label{portion_info} (source: {ing.source})")
+            # Validation is already done by Pydantic validator in schemas.py
+            # Just log for debugging
+            if _DEBUG_PER_ITEM:
+                for ing in parsed_update.updated_ingredients:
+                    if ing.amount is not None:
+                        print(f"DEBUG:   - {ing.name}: {ing.amount}g (source: {ing.source})")
+                    else:
+                        portion_info = f" [{ing.portion_label}]" if ing.portion_label else ""
+                        print(f"DEBUG:   - {ing.name}: portion_label{portion_info} (source: {ing.source})")
 
             print(f"DEBUG: Updated assumptions: {len(parsed_update.updated_assumptions)}")
         else:
@@ -182,6 +348,26 @@ Please retry the request and provide ONLY the JSON response.
         return None, 0
 
 
+# Stage-2 skip rules. These are substring checks ("mcdonald" in "mcdonald's",
+# "shake" in "milkshake"), so each set is searched with one alternation regex.
+_KNOWN_BRANDS = frozenset({'mcdonalds', 'mcdonald', 'kfc', 'subway', 'starbucks', 'burger king',
+                           'dominos', 'pizza hut', 'taco bell', 'chipotle', 'wendys', 'arbys'})
+_SIZE_LABELS = frozenset({'small', 'medium', 'large', 'regular', 'grande', 'venti'})
+_SINGLE_SERVE_BEVERAGE_PORTIONS = frozenset({'can', 'bottle', 'small', 'medium', 'large', 'regular'})
+_BEVERAGE_KEYWORDS = frozenset({'cola', 'soda', 'coffee', 'tea', 'juice', 'water', 'drink', 'shake', 'smoothie'})
+
+
+def _any_substring_re(words: frozenset) -> re.Pattern:
+    """Compile a regex whose search() is true iff any of the words occurs as a substring."""
+    return re.compile('|'.join(re.escape(word) for word in sorted(words)))
+
+
+_KNOWN_BRANDS_RE = _any_substring_re(_KNOWN_BRANDS)
+_SIZE_LABELS_RE = _any_substring_re(_SIZE_LABELS)
+_SINGLE_SERVE_PORTIONS_RE = _any_substring_re(_SINGLE_SERVE_BEVERAGE_PORTIONS)
+_BEVERAGE_KEYWORDS_RE = _any_substring_re(_BEVERAGE_KEYWORDS)
+
+
 def should_trigger_stage2(ingredients: List[Dict[str, Any]]) -> bool:
     """
     Determine if Stage-2 quantity verification should trigger.
@@ -200,11 +386,9 @@ def should_trigger_stage2(ingredients: List[Dict[str, Any]]) -> bool:
     Returns:
         True if Stage-2 should trigger
     """
-    # Known brands for fast-food/restaurant meals
-    KNOWN_BRANDS = {'mcdonalds', 'mcdonald', 'kfc', 'subway', 'starbucks', 'burger king',
-                    'dominos', 'pizza hut', 'taco bell', 'chipotle', 'wendys', 'arbys'}
-    SIZE_LABELS = {'small', 'medium', 'large', 'regular', 'grande', 'venti'}
-    SINGLE_SERVE_BEVERAGE_PORTIONS = {'can', 'bottle', 'small', 'medium', 'large', 'regular'}
+    # Nothing would trigger for a single labelled ingredient, so skip the pattern scans
+    if len(ingredients) < 2 and all(ing.get('portion_label') for ing in ingredients):
+        return False
 
     # Check if all ingredients are branded+sized (skip Stage-2 for McDonald's meals)
     all_branded_sized = True
@@ -213,15 +397,12 @@ def should_trigger_stage2(ingredients: List[Dict[str, Any]]) -> bool:
         portion = (ing.get('portion_label') or '').lower()
         name = (ing.get('name') or '').lower()
 
-        # Check if this ingredient is branded+sized
-        has_brand = any(brand in notes or brand in name for brand in KNOWN_BRANDS)
-        has_size = any(size in portion for size in SIZE_LABELS)
-
-        # Check if single-serve beverage
-        is_beverage = any(bev in name for bev in ['cola', 'soda', 'coffee', 'tea', 'juice', 'water', 'drink', 'shake', 'smoothie'])
-        has_single_serve = any(portion_type in portion for portion_type in SINGLE_SERVE_BEVERAGE_PORTIONS)
-
-        is_branded_sized = (has_brand and has_size) or (is_beverage and has_single_serve and portion)
+        # Branded+sized, or a single-serve beverage with a portion_label. The short portion
+        # is checked first, and notes/name are scanned for a brand in one pass (no brand
+        # contains the unit separator, so a match can't straddle the two).
+        is_branded_sized = (
+            _SIZE_LABELS_RE.search(portion) and _KNOWN_BRANDS_RE.search(f"{notes}\x1f{name}")
+        ) or (portion and _BEVERAGE_KEYWORDS_RE.search(name) and _SINGLE_SERVE_PORTIONS_RE.search(portion))
 
         if not is_branded_sized:
             all_branded_sized = False
@@ -243,6 +424,17 @@ def should_trigger_stage2(ingredients: List[Dict[str, Any]]) -> bool:
     return False
 
 
+def _ingredients_checksum(ingredients: List[Dict[str, Any]]) -> str:
+    """
+    Short checksum of ingredient names, used to detect stale Stage-2 answers.
+
+    Not security-relevant, so a 4-byte blake2b digest (8 hex chars) is enough. Names are
+    joined with the ASCII unit separator, which never appears in an ingredient name.
+    """
+    ingredient_signature = '\x1f'.join(ing.get('name') or '' for ing in ingredients)
+    return hashlib.blake2b(ingredient_signature.encode(), digest_size=4).hexdigest()
+
+
 def generate_stage2_question(ingredients: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Generate Stage-2 quantity confirmation question.
@@ -253,8 +445,6 @@ def generate_stage2_question(ingredients: List[Dict[str, Any]]) -> Dict[str, Any
     Returns:
         Question dict with id, text, options, follow_up_prompt, and checksum
     """
-    import hashlib
-
     # Build summary of current estimates
     portions_summary = []
     for ing in ingredients:
@@ -265,8 +455,7 @@ def generate_stage2_question(ingredients: List[Dict[str, Any]]) -> Dict[str, Any
     question_text = f"I estimated: {', '.join(portions_summary)}. Does this look right?"
 
     # Create checksum from ingredient names to detect stale answers
-    ingredient_signature = json.dumps([ing.get('name', '') for ing in ingredients], sort_keys=True)
-    checksum = hashlib.md5(ingredient_signature.encode()).hexdigest()[:8]
+    checksum = _ingredients_checksum(ingredients)
 
     return {
         "id": "qty_confirm",
@@ -280,6 +469,75 @@ def generate_stage2_question(ingredients: List[Dict[str, Any]]) -> Dict[str, Any
     }
 
 
+# Stage-2 lexicons. Groups are non-capturing so each pattern below yields only its own fields.
+_SIZE_LEXICON = r'\b(?:small|medium|regular|large|x-large|xl|xlarge|kid|side)\b'
+_VARIANT_LEXICON = r'\b(?:diet|zero|zero sugar|light|lite|coke zero|pepsi zero)\b'
+_UNIT_LEXICON = r'\b(?:cup|cups|tbsp|tsp|teaspoon|tablespoon|piece|pieces|slice|slices|scoop|scoops|oz|ounce|ounces|ml|l|liter|liters|g|gram|grams|kg)\b'
+
+# Synonym normalization for Stage-2 answers
+_STAGE2_SYNONYMS = {
+    'xl': 'x-large',
+    'xlarge': 'x-large',
+    'zero sugar': 'diet',
+    'coke zero': 'diet',
+    'pepsi zero': 'diet',
+    # "zero sugar" wins over the brand phrase, keeping the brand as the item head
+    'coke zero sugar': 'coke diet',
+    'pepsi zero sugar': 'pepsi diet',
+    'reg': 'regular',
+    'teaspoon': 'tsp',
+    'tablespoon': 'tbsp',
+    'ounce': 'oz',
+    'ounces': 'oz',
+    'gram': 'g',
+    'grams': 'g',
+    'liter': 'l',
+    'liters': 'l',
+}
+# Longest first so overlapping phrases resolve to the most specific synonym
+_STAGE2_SYNONYM_RE = re.compile(
+    r'\b(' + '|'.join(re.escape(syn) for syn in sorted(_STAGE2_SYNONYMS, key=len, reverse=True)) + r')\b'
+)
+
+_STAGE2_SEPARATOR_RE = re.compile(r'[;\n,]|\band\b|\b&\b')
+_STAGE2_ORDINAL_RE = re.compile(r'#(\d+)|(\d+)(?:st|nd|rd|th)|(first|second|third|fourth|fifth)')
+_STAGE2_ORDINAL_STRIP_RE = re.compile(r'#\d+|\d+(?:st|nd|rd|th)|\b(?:first|second|third|fourth|fifth)\b')
+_STAGE2_ORDINAL_WORDS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5}
+
+# Patterns 1-7 as one ordered alternation: at a given start the regex engine tries the
+# branches left to right, so under fullmatch the first pattern that fits the whole chunk
+# wins, exactly as the old one-pattern-at-a-time checks did. Each branch is wrapped in a
+# named group whose name is the key into _STAGE2_PATTERN_FIELDS.
+_STAGE2_MASTER_RE = re.compile('|'.join([
+    r'(?P<size_item>(?P<si_size>' + _SIZE_LEXICON + r')\s+(?P<si_item>.+))',                                   # "large fries"
+    r'(?P<variant_item>(?P<vi_variant>' + _VARIANT_LEXICON + r')\s+(?P<vi_item>.+))',                          # "diet cola"
+    r'(?P<qty_item>(?P<qi_qty>\d+(?:\.\d+)?)\s*(?P<qi_unit>' + _UNIT_LEXICON + r')\s+(?P<qi_item>.+))',        # "2 cups rice"
+    r'(?P<item_size>(?P<is_item>.+?)\s+(?P<is_size>' + _SIZE_LEXICON + r'))',                                  # "fries large"
+    r'(?P<item_variant>(?P<iv_item>.+?)\s+(?P<iv_variant>' + _VARIANT_LEXICON + r'))',                         # "cola diet"
+    r'(?P<item_qty>(?P<iq_item>.+?)\s+(?P<iq_qty>\d+(?:\.\d+)?)\s*(?P<iq_unit>' + _UNIT_LEXICON + r'))',       # "rice 2 cups"
+    r'(?P<item_value>(?P<kv_item>.+?)\s*[:=]\s*(?P<kv_value>.+))',                                            # "rice: 2 cups"
+]))
+
+# Dispatch table: branch name -> (action, item group, value groups joined with a space).
+# item_value is resolved separately because its action depends on what the value is.
+_STAGE2_PATTERN_FIELDS = {
+    "size_item": ("SET_PORTION_LABEL", "si_item", ("si_size",)),
+    "variant_item": ("SET_VARIANT", "vi_item", ("vi_variant",)),
+    "qty_item": ("SET_PORTION_LABEL", "qi_item", ("qi_qty", "qi_unit")),
+    "item_size": ("SET_PORTION_LABEL", "is_item", ("is_size",)),
+    "item_variant": ("SET_VARIANT", "iv_item", ("iv_variant",)),
+    "item_qty": ("SET_PORTION_LABEL", "iq_item", ("iq_qty", "iq_unit")),
+}
+_STAGE2_SIZE_RE = re.compile(_SIZE_LEXICON)
+_STAGE2_VARIANT_RE = re.compile(_VARIANT_LEXICON)
+_STAGE2_QTY_RE = re.compile(r'^\d+(?:\.\d+)?\s*' + _UNIT_LEXICON + r'$')
+
+
+def _expand_stage2_synonym(match: re.Match) -> str:
+    """re.sub callback for _STAGE2_SYNONYM_RE."""
+    return _STAGE2_SYNONYMS[match.group(1)]
+
+
 def _deterministic_parse_stage2(user_text: str) -> List[Dict[str, Any]]:
     """
     Deterministic pre-parser for Stage-2 adjustments using regex and lexicons.
@@ -287,160 +545,57 @@ def _deterministic_parse_stage2(user_text: str) -> List[Dict[str, Any]]:
     Returns:
         List of edit dicts with {"action": str, "item_head": str, "value": str, "variant": str (optional)}
     """
-    import re
-
-    # Lexicons
-    SIZE_LEXICON = r'\b(small|medium|regular|large|x-large|xl|xlarge|kid|side)\b'
-    VARIANT_LEXICON = r'\b(diet|zero|zero sugar|light|lite|coke zero|pepsi zero)\b'
-    UNIT_LEXICON = r'\b(cup|cups|tbsp|tsp|teaspoon|tablespoon|piece|pieces|slice|slices|scoop|scoops|oz|ounce|ounces|ml|l|liter|liters|g|gram|grams|kg)\b'
-
-    # Synonym normalization
-    SYNONYMS = {
-        'xl': 'x-large',
-        'xlarge': 'x-large',
-        'zero sugar': 'diet',
-        'coke zero': 'diet',
-        'pepsi zero': 'diet',
-        'reg': 'regular',
-        'teaspoon': 'tsp',
-        'tablespoon': 'tbsp',
-        'ounce': 'oz',
-        'ounces': 'oz',
-        'gram': 'g',
-        'grams': 'g',
-        'liter': 'l',
-        'liters': 'l',
-    }
-
-    # Split on separators
-    separators = r'[;\n,]|\band\b|\b&\b'
-    chunks = re.split(separators, user_text)
-    chunks = [c.strip() for c in chunks if c.strip()]
-
     edits = []
 
-    for chunk in chunks:
-        chunk_lower = chunk.lower()
-        chunk_normalized = ' '.join(chunk_lower.split())  # Collapse spaces
+    for chunk in _STAGE2_SEPARATOR_RE.split(user_text):
+        # Lowercase and collapse spaces; split() also drops surrounding whitespace
+        chunk_normalized = ' '.join(chunk.lower().split())
+        if not chunk_normalized:
+            continue
 
-        # Apply synonyms
-        for syn, replacement in SYNONYMS.items():
-            chunk_normalized = re.sub(r'\b' + re.escape(syn) + r'\b', replacement, chunk_normalized)
+        # Apply synonyms (single scan over all of them)
+        chunk_normalized = _STAGE2_SYNONYM_RE.sub(_expand_stage2_synonym, chunk_normalized)
 
         # Check for ordinal markers (#2, second, 2nd)
         ordinal = None
-        ordinal_match = re.search(r'#(\d+)|(\d+)(?:st|nd|rd|th)|(first|second|third|fourth|fifth)', chunk_normalized)
+        ordinal_match = _STAGE2_ORDINAL_RE.search(chunk_normalized)
         if ordinal_match:
             if ordinal_match.group(1):  # #2
                 ordinal = int(ordinal_match.group(1))
             elif ordinal_match.group(2):  # 2nd
                 ordinal = int(ordinal_match.group(2))
             elif ordinal_match.group(3):  # second
-                ordinal_words = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5}
-                ordinal = ordinal_words.get(ordinal_match.group(3), 1)
+                ordinal = _STAGE2_ORDINAL_WORDS.get(ordinal_match.group(3), 1)
             # Remove ordinal from chunk
-            chunk_normalized = re.sub(r'#\d+|\d+(?:st|nd|rd|th)|\b(?:first|second|third|fourth|fifth)\b', '', chunk_normalized).strip()
-
-        # Pattern 1: <size> <item> (e.g., "large fries")
-        match = re.match(r'^(' + SIZE_LEXICON + r')\s+(.+)$', chunk_normalized)
-        if match:
-            size, item_name = match.groups()
-            edits.append({
-                "action": "SET_PORTION_LABEL",
-                "item_head": item_name.strip(),
-                "value": size.strip(),
-                "ordinal": ordinal
-            })
-            continue
-
-        # Pattern 2: <variant> <item> (e.g., "diet cola")
-        match = re.match(r'^(' + VARIANT_LEXICON + r')\s+(.+)$', chunk_normalized)
-        if match:
-            variant, item_name = match.groups()
-            edits.append({
-                "action": "SET_VARIANT",
-                "item_head": item_name.strip(),
-                "variant": variant.strip(),
-                "ordinal": ordinal
-            })
-            continue
-
-        # Pattern 3: <qty> <unit> <item> (e.g., "2 cups rice", "12 oz cola")
-        match = re.match(r'^(\d+(?:\.\d+)?)\s*(' + UNIT_LEXICON + r')\s+(.+)$', chunk_normalized)
-        if match:
-            qty, unit, item_name = match.groups()
-            edits.append({
-                "action": "SET_PORTION_LABEL",
-                "item_head": item_name.strip(),
-                "value": f"{qty} {unit}".strip(),
-                "ordinal": ordinal
-            })
-            continue
+            chunk_normalized = _STAGE2_ORDINAL_STRIP_RE.sub('', chunk_normalized).strip()
 
-        # Pattern 4: <item> <size> (e.g., "fries large")
-        match = re.match(r'^(.+?)\s+(' + SIZE_LEXICON + r')$', chunk_normalized)
+        match = _STAGE2_MASTER_RE.fullmatch(chunk_normalized)
         if match:
-            item_name, size = match.groups()
-            edits.append({
-                "action": "SET_PORTION_LABEL",
-                "item_head": item_name.strip(),
-                "value": size.strip(),
-                "ordinal": ordinal
-            })
-            continue
-
-        # Pattern 5: <item> <variant> (e.g., "cola diet")
-        match = re.match(r'^(.+?)\s+(' + VARIANT_LEXICON + r')$', chunk_normalized)
-        if match:
-            item_name, variant = match.groups()
-            edits.append({
-                "action": "SET_VARIANT",
-                "item_head": item_name.strip(),
-                "variant": variant.strip(),
-                "ordinal": ordinal
-            })
-            continue
+            kind = match.lastgroup
+            if kind == "item_value":
+                # Pattern 7: <item>: <value> or <item>=<value> - keep only size/variant/qty values
+                item_name, value = match.group("kv_item", "kv_value")
+                if _STAGE2_SIZE_RE.match(value):
+                    action = "SET_PORTION_LABEL"
+                elif _STAGE2_VARIANT_RE.match(value):
+                    action = "SET_VARIANT"
+                elif _STAGE2_QTY_RE.match(value):
+                    action = "SET_PORTION_LABEL"
+                else:
+                    continue
+            else:
+                action, item_group, value_groups = _STAGE2_PATTERN_FIELDS[kind]
+                item_name = match.group(item_group)
+                value = " ".join(match.group(group) for group in value_groups)
 
-        # Pattern 6: <item> <qty> <unit> (e.g., "rice 2 cups", "cola 12 oz")
-        match = re.match(r'^(.+?)\s+(\d+(?:\.\d+)?)\s*(' + UNIT_LEXICON + r')$', chunk_normalized)
-        if match:
-            item_name, qty, unit = match.groups()
             edits.append({
-                "action": "SET_PORTION_LABEL",
+                "action": action,
                 "item_head": item_name.strip(),
-                "value": f"{qty} {unit}".strip(),
+                "variant" if action == "SET_VARIANT" else "value": value.strip(),
                 "ordinal": ordinal
             })
             continue
 
-        # Pattern 7: <item>: <value> or <item>=<value>
-        match = re.match(r'^(.+?)\s*[:=]\s*(.+)$', chunk_normalized)
-        if match:
-            item_name, value = match.groups()
-            # Check if value is size or variant
-            if re.match(SIZE_LEXICON, value):
-                edits.append({
-                    "action": "SET_PORTION_LABEL",
-                    "item_head": item_name.strip(),
-                    "value": value.strip(),
-                    "ordinal": ordinal
-                })
-            elif re.match(VARIANT_LEXICON, value):
-                edits.append({
-                    "action": "SET_VARIANT",
-                    "item_head": item_name.strip(),
-                    "variant": value.strip(),
-                    "ordinal": ordinal
-                })
-            elif re.match(r'^\d+(?:\.\d+)?\s*' + UNIT_LEXICON + r'$', value):
-                edits.append({
-                    "action": "SET_PORTION_LABEL",
-                    "item_head": item_name.strip(),
-                    "value": value.strip(),
-                    "ordinal": ordinal
-                })
-            continue
-
         # No pattern matched - mark for LLM fallback
         edits.append({
             "action": "UNPARSED",
@@ -450,7 +605,21 @@ def _deterministic_parse_stage2(user_text: str) -> List[Dict[str, Any]]:
     return edits
 
 
-def apply_stage2_adjustments(ingredients: List[Dict[str, Any]], stage2_answer: dict, chat_session: genai.ChatSession, available_tools: dict) -> dict:
+# Stage-2 answers that accept the shown portions unchanged (compared casefolded)
+_ACCEPT_PHRASES = frozenset({"looks right", "yes", "correct", "good", "ok", "okay", "lgtm"})
+
+
+class Stage2Result(TypedDict):
+    """Outcome of apply_stage2_adjustments()."""
+    ok: bool
+    ingredients: List[Dict[str, Any]]
+    applied_count: int
+    message: str
+    match_map: Dict[str, str]  # edit item_head -> matched ingredient name
+    skipped_count: NotRequired[int]  # only on success
+
+
+def apply_stage2_adjustments(ingredients: List[Dict[str, Any]], stage2_answer: dict, chat_session: genai.ChatSession, available_tools: dict) -> Stage2Result:
     """
     Apply Stage-2 quantity adjustments to ingredients using deterministic-first parsing.
 
@@ -461,17 +630,13 @@ def apply_stage2_adjustments(ingredients: List[Dict[str, Any]], stage2_answer: d
         available_tools: Dict of available tools
 
     Returns:
-        Dict with {"ok": bool, "ingredients": list, "applied_count": int, "message": str, "match_map": dict}
+        Stage2Result dict (ok, ingredients, applied_count, message, match_map, skipped_count on success)
     """
-    import re
-    import hashlib
-
     answer_value = stage2_answer.get("qty_confirm", "").strip()
     answer_checksum = stage2_answer.get("checksum", "")
 
     # Validate checksum to prevent stale answers
-    ingredient_signature = json.dumps([ing.get('name', '') for ing in ingredients], sort_keys=True)
-    current_checksum = hashlib.md5(ingredient_signature.encode()).hexdigest()[:8]
+    current_checksum = _ingredients_checksum(ingredients)
 
     if answer_checksum and answer_checksum != current_checksum:
         print(f"ERROR: Stage-2 checksum mismatch (stale answer)")
@@ -485,7 +650,7 @@ def apply_stage2_adjustments(ingredients: List[Dict[str, Any]], stage2_answer: d
         }
 
     # If user said "Looks right", no changes needed
-    if answer_value.lower() in ["looks right", "yes", "correct", "good"]:
+    if answer_value.casefold() in _ACCEPT_PHRASES:
         print(f"DEBUG: Stage-2 accepted as-is")
         print(f"METRICS: {json.dumps({'event': 'qa_quantity_skip', 'reason': 'user_accepted'})}")
         return {
@@ -503,7 +668,8 @@ def apply_stage2_adjustments(ingredients: List[Dict[str, Any]], stage2_answer: d
 
     # Separate parsable edits from unparsed chunks
     deterministic_edits = [e for e in parsed_edits if e.get("action") != "UNPARSED"]
-    unparsed_chunks = [e.get("chunk") for e in parsed_edits if e.get("action") == "UNPARSED"]
+    # Repeated chunks ("large fries, large fries") only need to reach the LLM once
+    unparsed_chunks = list(dict.fromkeys(e.get("chunk") for e in parsed_edits if e.get("action") == "UNPARSED"))
 
     match_map = {}
     parse_method = "regex" if deterministic_edits else "llm"
@@ -513,55 +679,84 @@ def apply_stage2_adjustments(ingredients: List[Dict[str, Any]], stage2_answer: d
     if unparsed_chunks and len(answer_value) >= 50:
         print(f"DEBUG: {len(unparsed_chunks)} chunks unparsed, trying LLM for: {unparsed_chunks}")
 
-        # Bulletize chunks to reduce null replies
-        bulletized_chunks = "\n".join([f"- {chunk}" for chunk in unparsed_chunks])
+        current_portions = json.dumps(
+            [{'name': ing.get('name'), 'portion_label': ing.get('portion_label')} for ing in ingredients],
+            separators=(',', ':')
+        )
+        portions_signature = compute_portions_signature(current_portions)
+
+        # Reuse earlier parses of the same chunk against the same portions
+        chunk_edits = {i: get_cached_stage2_edit(chunk, portions_signature) for i, chunk in enumerate(unparsed_chunks)}
+        pending = [i for i, edit in chunk_edits.items() if edit is None]
+        if len(pending) < len(unparsed_chunks):
+            parse_method = "hybrid"
 
-        adjustment_prompt = f"""
+        try:
+            if pending:
+                # Index chunks so the model answers each one by position in a single pass
+                indexed_chunks = "\n".join(f"[{n}] {unparsed_chunks[i]}" for n, i in enumerate(pending, 1))
+
+                adjustment_prompt = f"""
 User wants to adjust portion quantities. Original estimates:
-{json.dumps([{'name': ing.get('name'), 'portion_label': ing.get('portion_label')} for ing in ingredients], indent=2)}
+{current_portions}
 
-User's adjustments (only parse these):
-{bulletized_chunks}
+Inputs:
+{indexed_chunks}
 
-Parse the user's adjustments and return updated portion_label values. Return JSON only:
+For each input [i], return the ingredient it adjusts and its new portion_label, keyed by i. Return JSON only:
 
-{{
-  "adjustments": [
-    {{"name": "ingredient_name", "new_portion_label": "2 cups"}}
-  ]
-}}
+{{"1": {{"name": "ingredient_name", "new_portion_label": "2 cups"}}, "2": null}}
 
-CRITICAL: Only include items the user mentioned. Accept grams/mL if user specified them, otherwise use human units (cups, tbsp, pieces, slices).
+CRITICAL: Use null for an input that adjusts no ingredient. Accept grams/mL if user specified them, otherwise use human units (cups, tbsp, pieces, slices).
 """
 
-        try:
-            response_text, tool_calls = run_with_tools(chat_session, available_tools, adjustment_prompt)
+                response_text, tool_calls = _retry_with_backoff(
+                    lambda: run_with_tools(chat_session, available_tools, adjustment_prompt)
+                )
 
-            # Guard against empty/whitespace responses
-            if not response_text or not response_text.strip():
-                print(f"ERROR: LLM returned empty response for Stage-2 adjustments")
-                print(f"METRICS: {json.dumps({'event': 'qa_quantity_parse', 'method': 'llm', 'ok': False, 'reason': 'empty'})}")
-            else:
-                response_data = json.loads(response_text)
-                llm_edits_raw = response_data.get('adjustments', [])
-
-                # Convert LLM format to our edit format
-                for adj in llm_edits_raw:
-                    llm_edits.append({
-                        "action": "SET_PORTION_LABEL",
-                        "item_head": adj.get("name", ""),
-                        "value": adj.get("new_portion_label", "")
-                    })
-
-                print(f"DEBUG: Stage-2 LLM parse found {len(llm_edits)} additional adjustments")
-                parse_method = "hybrid"
+                # Guard against empty/whitespace responses
+                if not response_text or not response_text.strip():
+                    print(f"ERROR: LLM returned empty response for Stage-2 adjustments")
+                    print(f"METRICS: {json.dumps({'event': 'qa_quantity_parse', 'method': 'llm', 'ok': False, 'reason': 'empty'})}")
+                else:
+                    # Tool-enabled sessions run without JSON mode, so the reply may be fenced
+                    response_data = loads_json_or_repair(response_text)
+                    match_index = _build_match_index(ingredients)
+
+                    # Splice answers back by input position; missing/null entries are skipped
+                    for n, i in enumerate(pending, 1):
+                        adj = response_data.get(str(n))
+                        if not isinstance(adj, dict) or not adj.get("name"):
+                            if _DEBUG_PER_ITEM:
+                                print(f"DEBUG: Stage-2 LLM returned no adjustment for [{n}] '{unparsed_chunks[i]}'")
+                            continue
+                        chunk_edits[i] = {
+                            "action": "SET_PORTION_LABEL",
+                            "item_head": adj.get("name", ""),
+                            "value": adj.get("new_portion_label", "")
+                        }
+                        # Only replies naming a current ingredient are reused for later repeats
+                        matched_ing, _ = _safe_match_ingredient(chunk_edits[i]["item_head"], ingredients, match_index=match_index)
+                        if matched_ing is not None:
+                            cache_stage2_edit(unparsed_chunks[i], portions_signature, chunk_edits[i])
+
+                    parse_method = "hybrid"
         except Exception as e:
             print(f"ERROR: Failed to parse Stage-2 adjustments with LLM: {e}")
             print(f"METRICS: {json.dumps({'event': 'qa_quantity_parse', 'method': 'llm', 'ok': False, 'reason': str(e)})}")
-            # Don't fail - continue with deterministic edits only
+            # Don't fail - continue with deterministic and cached edits only
+
+        llm_edits = [edit for edit in chunk_edits.values() if edit]
+        print(f"DEBUG: Stage-2 LLM parse found {len(llm_edits)} additional adjustments")
 
-    # Combine deterministic + LLM edits
-    all_edits = deterministic_edits + llm_edits
+    # Combine deterministic + LLM edits, dropping exact repeats so no edit is applied twice.
+    # The last occurrence keeps its position, so the final state matches applying all of them.
+    unique_edits = {}
+    for e in deterministic_edits + llm_edits:
+        edit_key = (e.get("action"), e.get("item_head"), e.get("value"), e.get("variant"), e.get("ordinal"))
+        unique_edits.pop(edit_key, None)
+        unique_edits[edit_key] = e
+    all_edits = list(unique_edits.values())
 
     if not all_edits:
         print(f"ERROR: No edits parsed from user input")
@@ -575,10 +770,6 @@ CRITICAL: Only include items the user mentioned. Accept grams/mL if user specifi
         }
 
     # Step 3: Apply edits with safe matching and variant handling
-    from .normalize import normalize_for_matching, canonicalize_name
-    from .schemas import Ingredient
-    import uuid
-
     changed_count = 0
     added_count = 0
     variant_count = 0
@@ -587,6 +778,10 @@ CRITICAL: Only include items the user mentioned. Accept grams/mL if user specifi
     # Soft drink keywords for variant detection
     SOFT_DRINK_KEYWORDS = ['cola', 'coke', 'pepsi', 'sprite', 'fanta', 'soda', 'pop', 'lemonade', 'tea', 'coffee']
 
+    # Matching data built once per ingredient, not once per (edit, ingredient) pair.
+    # Setting a variant only rewrites the parenthetical, so the index stays valid in the loop.
+    match_index = _build_match_index(ingredients)
+
     for edit in all_edits:
         action = edit.get("action")
         item_head = edit.get("item_head", "")
@@ -595,12 +790,13 @@ CRITICAL: Only include items the user mentioned. Accept grams/mL if user specifi
         ordinal = edit.get("ordinal")
 
         # Use safe matching to find ingredient (with ordinal disambiguation if provided)
-        matched_ing, confidence = _safe_match_ingredient(item_head, ingredients, ordinal=ordinal)
+        matched_ing, confidence = _safe_match_ingredient(item_head, ingredients, ordinal=ordinal, match_index=match_index)
 
         if not matched_ing:
             # No match - skip this edit for now
             skipped_edits.append({"item": item_head, "reason": "no_match"})
-            print(f"DEBUG: Stage-2 couldn't match '{item_head}' to any ingredient (skipped)")
+            if _DEBUG_PER_ITEM:
+                print(f"DEBUG: Stage-2 couldn't match '{item_head}' to any ingredient (skipped)")
             continue
 
         if action == "SET_PORTION_LABEL":
@@ -610,7 +806,8 @@ CRITICAL: Only include items the user mentioned. Accept grams/mL if user specifi
             matched_ing['source'] = 'user'  # Mark as user-provided
             changed_count += 1
             match_map[item_head] = matched_ing.get('name')
-            print(f"DEBUG: Stage-2 adjusted '{matched_ing.get('name')}': portion_label '{old_portion}' → '{value}'")
+            if _DEBUG_PER_ITEM:
+                print(f"DEBUG: Stage-2 adjusted '{matched_ing.get('name')}': portion_label '{old_portion}' → '{value}'")
 
         elif action == "SET_VARIANT" and variant:
             # Handle variant (diet/zero/light) for soft drinks
@@ -629,20 +826,20 @@ CRITICAL: Only include items the user mentioned. Accept grams/mL if user specifi
                 matched_ing['source'] = 'user'
                 variant_count += 1
                 match_map[item_head] = new_name
-                print(f"DEBUG: Stage-2 set variant for '{base_name}': → '{new_name}'")
+                if _DEBUG_PER_ITEM:
+                    print(f"DEBUG: Stage-2 set variant for '{base_name}': → '{new_name}'")
             else:
                 # Not a soft drink - skip variant setting
                 skipped_edits.append({"item": item_head, "reason": "variant_not_applicable"})
-                print(f"DEBUG: Stage-2 skipped variant '{variant}' for '{ing_name}' (not a soft drink)")
+                if _DEBUG_PER_ITEM:
+                    print(f"DEBUG: Stage-2 skipped variant '{variant}' for '{ing_name}' (not a soft drink)")
 
     # Step 4: Emit metrics (partial success model)
     total_changes = changed_count + variant_count + added_count
     parse_ok = total_changes > 0
 
-    print(f"METRICS: {json.dumps({'event': 'qa_quantity_parse', 'method': parse_method, 'ok': parse_ok, 'items': len(all_edits)})}")
-    print(f"METRICS: {json.dumps({'event': 'qa_quantity_applied_partial', 'applied': total_changes, 'skipped': len(skipped_edits)})}")
-    print(f"METRICS: {json.dumps({'event': 'qa_quantity_changed', 'changed': changed_count, 'variant': variant_count, 'added': added_count, 'total': len(ingredients)})}")
-    print(f"METRICS: {json.dumps({'event': 'qa_quantity_match_map', 'map': match_map})}")
+    # One line per Stage-2 answer: parse outcome, partial-apply counts and the match map
+    print(f"METRICS: {json.dumps({'event': 'qa_quantity_parse', 'method': parse_method, 'ok': parse_ok, 'items': len(all_edits), 'applied': total_changes, 'skipped': len(skipped_edits), 'changed': changed_count, 'variant': variant_count, 'added': added_count, 'total': len(ingredients), 'map': match_map})}")
 
     # Build user message (partial success feedback)
     if total_changes == 0 and skipped_edits:
@@ -706,7 +903,46 @@ def _extract_head_term(ingredient_name: str) -> str:
     return tokens[-1] if len(tokens) > 1 else tokens[0]
 
 
-def _safe_match_ingredient(item_head: str, ingredients: List[Dict[str, Any]], ordinal: int = None) -> tuple[Dict[str, Any] | None, float]:
+def _build_match_index(ingredients: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Precompute per-ingredient matching data for _safe_match_ingredient().
+
+    Args:
+        ingredients: List of ingredient dicts
+
+    Returns:
+        Dict with parallel per-ingredient lists "heads" (normalized head term),
+        "head0s" (first head token, "" for an empty head), "masks" (int bitmask of head
+        tokens) and "token_counts" (distinct head tokens), plus "token_bits" (token -> its bit),
+        "head_buckets" (normalized head -> ingredient indices) and "mask_counts" (mask -> count)
+    """
+    heads = [normalize_for_matching(_extract_head_term(ing.get('name', ''))) for ing in ingredients]
+
+    head0s = []
+    masks = []
+    token_counts = []
+    token_bits = {}
+    for head in heads:
+        words = head.split()
+        head0s.append(words[0] if words else "")
+
+        mask = 0
+        for token in set(words):
+            bit = token_bits.setdefault(token, 1 << len(token_bits))
+            mask |= bit
+        masks.append(mask)
+        token_counts.append(mask.bit_count())
+
+    head_buckets = defaultdict(list)
+    for idx, head in enumerate(heads):
+        head_buckets[head].append(idx)
+
+    return {"heads": heads, "head0s": head0s, "masks": masks, "token_counts": token_counts,
+            "token_bits": token_bits, "head_buckets": head_buckets, "mask_counts": Counter(masks)}
+
+
+def _safe_match_ingredient(item_head: str, ingredients: List[Dict[str, Any]], ordinal: int = None,
+                           match_index: Dict[str, Any] = None) -> tuple[Dict[str, Any] | None, float]:
     """
     Safely match item_head to an ingredient using Jaccard similarity.
     Prevents loose "in" matching that caused dal->daliya bug.
@@ -715,25 +951,65 @@ def _safe_match_ingredient(item_head: str, ingredients: List[Dict[str, Any]], or
         item_head: Normalized item name from user edit
         ingredients: List of ingredient dicts
         ordinal: Optional 1-based index for disambiguation (e.g., "cola #2" -> ordinal=2)
+        match_index: Optional _build_match_index(ingredients) result, reused across edits
 
     Returns:
         Tuple of (matched_ingredient, confidence_score) or (None, 0.0)
     """
-    from .normalize import normalize_for_matching
-
     item_head_normalized = normalize_for_matching(item_head)
     item_head_tokens = set(item_head_normalized.split())
+    item_token_count = len(item_head_tokens)
 
     # Check if item_head is very short (≤3 chars) - require exact match
     is_short_token = len(item_head_normalized) <= 3
 
+    # For short tokens, require higher threshold
+    threshold = 0.7 if len(item_head_normalized) <= 5 else 0.6
+
+    if match_index is None:
+        match_index = _build_match_index(ingredients)
+    ing_heads = match_index["heads"]
+    ing_head0s = match_index["head0s"]
+    ing_masks = match_index["masks"]
+    ing_token_counts = match_index["token_counts"]
+
+    # Tokens no ingredient has get no bit: they count toward |A| but never intersect
+    token_bits = match_index["token_bits"]
+    item_mask = 0
+    for token in item_head_tokens:
+        item_mask |= token_bits.get(token, 0)
+
+    # A lone exact head hit wins outright (score 1.0 beats every fuzzy score by >= 0.1),
+    # unless another ingredient has the same token set (Jaccard 1.0) or the head has more
+    # than 8 tokens, where a near-identical name can land inside the 0.1 margin.
+    if not (ordinal is not None and ordinal > 0):
+        exact_indices = match_index["head_buckets"].get(item_head_normalized, ())
+        if len(exact_indices) == 1 and (
+            is_short_token or (item_token_count <= 8 and match_index["mask_counts"][item_mask] == 1)
+        ):
+            return (ingredients[exact_indices[0]], 1.0)
+
+    # Any exact or Jaccard match shares at least one token with item_head, so only
+    # ingredients whose mask overlaps it can match. A token-less head can still
+    # equal a token-less ingredient head, so scan everything in that case.
+    # Jaccard is at most min(|A|, |B|) / max(|A|, |B|), so ingredients whose token count
+    # is too far from the item's can never reach the threshold (bounds padded for rounding).
+    if item_head_tokens:
+        min_tokens = item_token_count * threshold - 1e-9
+        max_tokens = item_token_count / threshold + 1e-9
+        candidate_indices = [
+            idx for idx, mask in enumerate(ing_masks)
+            if mask & item_mask and min_tokens <= ing_token_counts[idx] <= max_tokens
+        ]
+    else:
+        candidate_indices = range(len(ingredients))
+
     candidates = []
 
-    for idx, ing in enumerate(ingredients):
-        ing_name = ing.get('name', '')
-        ing_head = _extract_head_term(ing_name)
-        ing_normalized = normalize_for_matching(ing_head)
-        ing_tokens = set(ing_normalized.split())
+    for idx in candidate_indices:
+        ing = ingredients[idx]
+        ing_normalized = ing_heads[idx]
+        ing_mask = ing_masks[idx]
 
         # Exact head match
         if item_head_normalized == ing_normalized:
@@ -744,14 +1020,10 @@ def _safe_match_ingredient(item_head: str, ingredients: List[Dict[str, Any]], or
         if is_short_token:
             continue
 
-        # Jaccard similarity
-        if item_head_tokens and ing_tokens:
-            overlap = item_head_tokens & ing_tokens
-            union = item_head_tokens | ing_tokens
-            jaccard = len(overlap) / len(union) if union else 0.0
-
-            # For short tokens, require higher threshold
-            threshold = 0.7 if len(item_head_normalized) <= 5 else 0.6
+        # Jaccard similarity (|A ∪ B| = |A| + |B| - |A ∩ B|, so no union set is built)
+        if item_head_tokens and ing_mask:
+            overlap_count = (item_mask & ing_mask).bit_count()
+            jaccard = overlap_count / (item_token_count + ing_token_counts[idx] - overlap_count)
 
             if jaccard >= threshold:
                 candidates.append((ing, jaccard, idx))
@@ -759,13 +1031,15 @@ def _safe_match_ingredient(item_head: str, ingredients: List[Dict[str, Any]], or
     if not candidates:
         return (None, 0.0)
 
-    # If ordinal specified, use it to pick the Nth match
-    if ordinal is not None and ordinal > 0:
+    # If ordinal specified, use it to pick the Nth match. A lone candidate is returned
+    # below either way, and an ordinal past the candidate count can never be satisfied.
+    if ordinal is not None and 0 < ordinal <= len(candidates) and len(candidates) > 1:
         # Filter candidates by same head term
-        head_term = item_head_normalized.split()[0] if item_head_normalized else ""
+        item_words = item_head_normalized.split()
+        head_term = item_words[0] if item_words else ""
         same_head_candidates = [
             c for c in candidates
-            if normalize_for_matching(_extract_head_term(c[0].get('name', ''))).split()[0] == head_term
+            if ing_head0s[c[2]] == head_term
         ]
         if len(same_head_candidates) >= ordinal:
             return (same_head_candidates[ordinal - 1][0], same_head_candidates[ordinal - 1][1])
@@ -781,37 +1055,38 @@ def _safe_match_ingredient(item_head: str, ingredients: List[Dict[str, Any]], or
     return (None, 0.0)
 
 
-def _names_match(name1_normalized: str, name2_normalized: str) -> bool:
+def _vision_ingredient_to_dict(ingredient: Any) -> Dict[str, Any] | None:
     """
-    Tightened name matching using head-token equality.
+    Project a vision-estimate ingredient to {"name", "amount"}.
 
-    Args:
-        name1_normalized: First normalized name (tokens)
-        name2_normalized: Second normalized name (tokens)
-
-    Returns:
-        True if names match with sufficient confidence
+    Objects with name/amount attributes (e.g. schemas.Ingredient) and plain dicts are
+    supported; anything else returns None and is skipped by the caller.
     """
-    tokens1 = set(name1_normalized.split())
-    tokens2 = set(name2_normalized.split())
+    if hasattr(ingredient, 'name') and hasattr(ingredient, 'amount'):
+        return {"name": ingredient.name, "amount": ingredient.amount}
+    if isinstance(ingredient, dict):
+        return {"name": ingredient.get('name', ''), "amount": ingredient.get('amount', 0)}
+    return None
 
-    if not tokens1 or not tokens2:
-        return False
 
-    # Get head tokens (first meaningful token)
-    head1 = name1_normalized.split()[0]
-    head2 = name2_normalized.split()[0]
+def _refined_ingredient_to_dict(ingredient: Any) -> Dict[str, Any]:
+    """
+    Convert a refinement's updated ingredient to a mutable dict.
 
-    # Require head token equality
-    if head1 == head2:
-        return True
+    Pydantic models are dumped in full, dicts are copied, and other objects fall back to
+    their name/amount attributes.
+    """
+    model_dump = getattr(ingredient, 'model_dump', None)
+    if model_dump is not None:
+        return model_dump()
+    if isinstance(ingredient, dict):
+        return ingredient.copy()
+    return {"name": getattr(ingredient, 'name', ''), "amount": getattr(ingredient, 'amount', None)}
 
-    # Or require significant token overlap (at least 1 common token and one must be the head)
-    overlap = tokens1 & tokens2
-    if overlap and (head1 in overlap or head2 in overlap):
-        return True
 
-    return False
+# Dish-level names that the dedup safety net drops in favour of their specific components
+_COMPOSITE_TERMS = frozenset({'smoothie', 'shake', 'bowl', 'salad', 'soup', 'biryani', 'wrap', 'pizza', 'plate', 'mix'})
+_COMPOSITE_TERMS_RE = _any_substring_re(_COMPOSITE_TERMS)
 
 
 def generate_final_calculation(chat_session: genai.ChatSession, available_tools: dict = None, vision_estimate: VisionEstimate = None, refinements: list = None, stage2_answer: dict = None) -> tuple[str, int]:
@@ -835,17 +1110,10 @@ def generate_final_calculation(chat_session: genai.ChatSession, available_tools:
         ingredients = []
 
         if vision_estimate and hasattr(vision_estimate, 'ingredients'):
-            for ingredient in vision_estimate.ingredients:
-                if hasattr(ingredient, 'name') and hasattr(ingredient, 'amount'):
-                    ingredients.append({
-                        "name": ingredient.name,
-                        "amount": ingredient.amount
-                    })
-                elif isinstance(ingredient, dict):
-                    ingredients.append({
-                        "name": ingredient.get('name', ''),
-                        "amount": ingredient.get('amount', 0)
-                    })
+            ingredients = [
+                ing_dict for ing_dict in map(_vision_ingredient_to_dict, vision_estimate.ingredients)
+                if ing_dict is not None
+            ]
 
         # Collect assumptions from refinements
         assumptions = []
@@ -854,36 +1122,33 @@ def generate_final_calculation(chat_session: genai.ChatSession, available_tools:
         if refinements:
             print(f"DEBUG: Applying {len(refinements)} refinements")
 
-            # Build ingredient map by ID for efficient lookups
+            # Build ingredient map by ID for efficient lookups; kept up to date in place below
             ingredient_map = {}
             for ing in ingredients:
                 ing_id = ing.get('id')
                 if ing_id:
                     ingredient_map[ing_id] = ing
 
+            # The list is only materialized after the last refinement: it is the map entries
+            # that existed before that refinement's additions, followed by all its additions
+            kept_count = None
+            last_items_to_add = None
+
             for refinement in refinements:
                 # Collect assumptions
-                if hasattr(refinement, 'updated_assumptions') and refinement.updated_assumptions:
-                    for assumption in refinement.updated_assumptions:
-                        if hasattr(assumption, 'model_dump'):
-                            assumptions.append(assumption.model_dump())
+                updated_assumptions = getattr(refinement, 'updated_assumptions', None)
+                if updated_assumptions:
+                    for assumption in updated_assumptions:
+                        model_dump = getattr(assumption, 'model_dump', None)
+                        if model_dump is not None:
+                            assumptions.append(model_dump())
                         elif isinstance(assumption, dict):
                             assumptions.append(assumption)
 
-                if hasattr(refinement, 'updated_ingredients') and refinement.updated_ingredients:
+                updated_ingredients = getattr(refinement, 'updated_ingredients', None)
+                if updated_ingredients:
                     # Convert to dicts
-                    updated_dicts = []
-                    for updated_ingredient in refinement.updated_ingredients:
-                        if hasattr(updated_ingredient, 'model_dump'):
-                            ingredient_dict = updated_ingredient.model_dump()
-                        elif isinstance(updated_ingredient, dict):
-                            ingredient_dict = updated_ingredient.copy()
-                        else:
-                            ingredient_dict = {
-                                "name": updated_ingredient.name if hasattr(updated_ingredient, 'name') else '',
-                                "amount": updated_ingredient.amount if hasattr(updated_ingredient, 'amount') else None
-                            }
-                        updated_dicts.append(ingredient_dict)
+                    updated_dicts = [_refined_ingredient_to_dict(ing) for ing in updated_ingredients]
 
                     # ID-based merge: Remove parents, add/update children
                     parents_to_remove = set()
@@ -896,87 +1161,110 @@ def generate_final_calculation(chat_session: genai.ChatSession, available_tools:
                         if parent_id:
                             # Mark parent for removal
                             parents_to_remove.add(parent_id)
-                            print(f"DEBUG: Item '{ing_dict.get('name')}' replaces parent_id={parent_id}")
+                            if _DEBUG_PER_ITEM:
+                                print(f"DEBUG: Item '{ing_dict.get('name')}' replaces parent_id={parent_id}")
 
                         if ing_id and ing_id in ingredient_map:
                             # Update existing item
                             ingredient_map[ing_id].update(ing_dict)
-                            print(f"DEBUG: Updated existing → id={ing_id}, name='{ing_dict.get('name')}'")
+                            if _DEBUG_PER_ITEM:
+                                print(f"DEBUG: Updated existing → id={ing_id}, name='{ing_dict.get('name')}'")
                         else:
                             # New item
                             items_to_add.append(ing_dict)
-                            print(f"DEBUG: New item → name='{ing_dict.get('name')}'")
+                            if _DEBUG_PER_ITEM:
+                                print(f"DEBUG: New item → name='{ing_dict.get('name')}'")
 
                     # Remove parents
                     for parent_id in parents_to_remove:
                         if parent_id in ingredient_map:
                             removed = ingredient_map.pop(parent_id)
-                            print(f"DEBUG: Removed parent → id={parent_id}, name='{removed.get('name')}'")
+                            if _DEBUG_PER_ITEM:
+                                print(f"DEBUG: Removed parent → id={parent_id}, name='{removed.get('name')}'")
 
-                    # Rebuild ingredient list
-                    ingredients = list(ingredient_map.values()) + items_to_add
+                    # Register new items for the next refinement; items without an ID only
+                    # survive if this turns out to be the last refinement
+                    kept_count = len(ingredient_map)
+                    last_items_to_add = items_to_add
+                    for item in items_to_add:
+                        item_id = item.get('id')
+                        if item_id:
+                            ingredient_map[item_id] = item
 
-                    # Rebuild map for next iteration
-                    ingredient_map = {ing.get('id'): ing for ing in ingredients if ing.get('id')}
+                    print(f"DEBUG: After refinement: {kept_count + len(items_to_add)} ingredients, removed {len(parents_to_remove)} parents")
 
-                    print(f"DEBUG: After refinement: {len(ingredients)} ingredients, removed {len(parents_to_remove)} parents")
+            if last_items_to_add is not None:
+                ingredients = list(ingredient_map.values())[:kept_count] + last_items_to_add
 
         # Step 1.4: Canonical dedup safety net (prevents double-counting if LLM didn't set parent_id)
-        from .normalize import canonicalize_name
-        COMPOSITE_TERMS = {'smoothie', 'shake', 'bowl', 'salad', 'soup', 'biryani', 'wrap', 'pizza', 'plate', 'mix'}
-
         canonical_groups = {}
-        composite_items = []
+        canonical_flags = {}  # canonical -> (has_composite, has_specific), tracked while grouping
+        canonical_names = {}  # name -> canonicalize_name(name), reused by Step 2
+        composite_names = {}  # name -> whether it contains a composite term
         dropped_composites = 0
         deduped = 0
+        has_parent_refs = False
 
         for ing in ingredients:
             name = ing.get('name', '')
-            canonical = canonicalize_name(name)
-            name_lower = name.lower()
-
-            # Check if this is a composite term
-            is_composite = any(term in name_lower for term in COMPOSITE_TERMS)
+            canonical = canonical_names.get(name)
+            if canonical is None:
+                canonical = canonical_names[name] = canonicalize_name(name)
+                # Check if this is a composite term (once per distinct name)
+                composite_names[name] = _COMPOSITE_TERMS_RE.search(name.lower()) is not None
+            is_composite = composite_names[name]
 
             if canonical not in canonical_groups:
                 canonical_groups[canonical] = []
+                canonical_flags[canonical] = (False, False)
             canonical_groups[canonical].append((ing, is_composite))
+            has_composite, has_specific = canonical_flags[canonical]
+            canonical_flags[canonical] = (has_composite or is_composite, has_specific or not is_composite)
+            if ing.get('parent_id'):
+                has_parent_refs = True
 
         # For each canonical group, keep only specific ingredients (not composites)
-        filtered_ingredients = []
-        for canonical, items in canonical_groups.items():
-            if len(items) == 1:
-                # No conflict, keep it
-                filtered_ingredients.append(items[0][0])
-            else:
-                # Multiple items with same canonical name - keep specific over composite
-                has_composite = any(is_comp for _, is_comp in items)
-                has_specific = any(not is_comp for _, is_comp in items)
-
-                if has_composite and has_specific:
-                    # Keep only specific items, drop composites
-                    for ing, is_comp in items:
-                        if not is_comp:
-                            filtered_ingredients.append(ing)
-                        else:
-                            dropped_composites += 1
-                            print(f"DEBUG: Dedup safety net dropped composite '{ing.get('name')}'")
+        if len(canonical_groups) == len(ingredients):
+            # Every canonical name is distinct: nothing to drop, and the order is unchanged
+            filtered_ingredients = ingredients
+        else:
+            filtered_ingredients = []
+            for canonical, items in canonical_groups.items():
+                if len(items) == 1:
+                    # No conflict, keep it
+                    filtered_ingredients.append(items[0][0])
                 else:
-                    # All composite or all specific - keep all
-                    for ing, _ in items:
-                        filtered_ingredients.append(ing)
-                    if len(items) > 1:
-                        deduped += len(items) - 1
+                    # Multiple items with same canonical name - keep specific over composite
+                    has_composite, has_specific = canonical_flags[canonical]
+
+                    if has_composite and has_specific:
+                        # Keep only specific items, drop composites
+                        for ing, is_comp in items:
+                            if not is_comp:
+                                filtered_ingredients.append(ing)
+                            else:
+                                dropped_composites += 1
+                                if _DEBUG_PER_ITEM:
+                                    print(f"DEBUG: Dedup safety net dropped composite '{ing.get('name')}'")
+                    else:
+                        # All composite or all specific - keep all
+                        for ing, _ in items:
+                            filtered_ingredients.append(ing)
+                        if len(items) > 1:
+                            deduped += len(items) - 1
 
         ingredients = filtered_ingredients
         print(f"METRICS: {json.dumps({'event': 'merge_result', 'count': len(ingredients), 'dropped_composites': dropped_composites, 'deduped': deduped})}")
 
         # Guardrail: Check if any parent_id still exists in the list
-        ing_ids = {ing.get('id') for ing in ingredients if ing.get('id')}
-        for ing in ingredients:
-            parent_id = ing.get('parent_id')
-            if parent_id and parent_id in ing_ids:
-                print(f"WARN: Ingredient '{ing.get('name')}' has parent_id='{parent_id}' but parent still exists - this shouldn't happen")
+        # (only when some ingredient referenced a parent during the grouping pass)
+        if has_parent_refs:
+            child_ingredients = [ing for ing in ingredients if ing.get('parent_id')]
+            ing_ids = {ing.get('id') for ing in ingredients if ing.get('id')}
+            for ing in child_ingredients:
+                parent_id = ing['parent_id']
+                if parent_id in ing_ids:
+                    print(f"WARN: Ingredient '{ing.get('name')}' has parent_id='{parent_id}' but parent still exists - this shouldn't happen")
 
         # Step 1.5: Check if Stage-2 quantity verification should trigger
         if should_trigger_stage2(ingredients):
@@ -1015,20 +1303,22 @@ def generate_final_calculation(chat_session: genai.ChatSession, available_tools:
 
                 # Success - use updated ingredients
                 ingredients = result["ingredients"]
-                print(f"DEBUG: Stage-2 applied {result['applied_count']} changes: {result['match_map']}")
+                if _DEBUG_PER_ITEM:
+                    print(f"DEBUG: Stage-2 applied {result['applied_count']} changes: {result['match_map']}")
         else:
             print(f"DEBUG: Skipping Stage-2 (single ingredient with portion_label)")
 
         # Step 2: Canonicalize names (normalize aliases, portion labels) and categorize
-        from .normalize import canonicalize_name, canonicalize_portion_label, categorize_food
         print(f"DEBUG: Canonicalizing {len(ingredients)} ingredient names")
         for ingredient in ingredients:
             original_name = ingredient.get("name", "")
             original_portion = ingredient.get("portion_label", "")
 
-            # Canonicalize name (context-aware)
-            brand = ingredient.get("notes", "") or ""
-            canonical_name = canonicalize_name(original_name, brand=brand)
+            # Canonicalize name (context-aware). Brand context only applies when a category
+            # is passed, so names Stage-2 left untouched reuse the Step 1.4 result.
+            canonical_name = canonical_names.get(original_name)
+            if canonical_name is None:
+                canonical_name = canonicalize_name(original_name, brand=ingredient.get("notes", "") or "")
 
             # Canonicalize portion label
             canonical_portion = canonicalize_portion_label(original_portion)
@@ -1037,14 +1327,17 @@ def generate_final_calculation(chat_session: genai.ChatSession, available_tools:
             category = categorize_food(canonical_name if canonical_name else original_name)
             if category:
                 ingredient["category"] = category
-                print(f"DEBUG: Categorized '{ingredient.get('name')}' as '{category}'")
+                if _DEBUG_PER_ITEM:
+                    print(f"DEBUG: Categorized '{ingredient.get('name')}' as '{category}'")
 
             if canonical_name != original_name:
-                print(f"DEBUG: Canonicalized name: '{original_name}' → '{canonical_name}'")
+                if _DEBUG_PER_ITEM:
+                    print(f"DEBUG: Canonicalized name: '{original_name}' → '{canonical_name}'")
                 ingredient["name"] = canonical_name
 
             if canonical_portion and canonical_portion != original_portion:
-                print(f"DEBUG: Canonicalized portion: '{original_portion}' → '{canonical_portion}'")
+                if _DEBUG_PER_ITEM:
+                    print(f"DEBUG: Canonicalized portion: '{original_portion}' → '{canonical_portion}'")
                 ingredient["portion_label"] = canonical_portion
 
         # Step 3: Resolve portions deterministically (prevents LLM from inventing grams)
@@ -1062,21 +1355,25 @@ def generate_final_calculation(chat_session: genai.ChatSession, available_tools:
         scaled_items = deterministic_result.get('items', [])
         print(f"DEBUG: Running validations on {len(scaled_items)} scaled items")
         validations = run_all_validations(scaled_items)
-        print(f"DEBUG: Validation results: {validations}")
+        if _DEBUG_PER_ITEM:
+            print(f"DEBUG: Validation results: {validations}")
 
         # Step 4: Convert to legacy UI format
-        breakdown_items = []
         print(f"DEBUG: Converting {len(scaled_items)} items to legacy UI format")
-        for item in scaled_items:
-            breakdown_item = {
+        # round() with no ndigits already returns an int, so no int() wrapper is needed
+        breakdown_items = [
+            {
                 "item": item["name"],
-                "calories": int(round(item["kcal"])),
-                "protein_grams": int(round(item["protein_g"])),
-                "carbs_grams": int(round(item["carb_g"])),
-                "fat_grams": int(round(item["fat_g"]))
+                "calories": round(item["kcal"]),
+                "protein_grams": round(item["protein_g"]),
+                "carbs_grams": round(item["carb_g"]),
+                "fat_grams": round(item["fat_g"])
             }
-            breakdown_items.append(breakdown_item)
-            print(f"DEBUG: Converted item: {breakdown_item}")
+            for item in scaled_items
+        ]
+        if _DEBUG_PER_ITEM:
+            for breakdown_item in breakdown_items:
+                print(f"DEBUG: Converted item: {breakdown_item}")
 
         # Step 5: Build complete final JSON with USDA attribution (no confidence score for users)
         attribution = deterministic_result.get('attribution', [])
@@ -1102,24 +1399,23 @@ def generate_final_calculation(chat_session: genai.ChatSession, available_tools:
         }
 
         # Step 6: Ask LLM for explanation only (not calculations)
-        explanation_prompt = f"""
-Based on our conversation, I've calculated the nutritional breakdown using USDA data. Here are the results:
-
-{json.dumps(breakdown_items, indent=2)}
-
-Please provide a brief explanation of the assumptions made and suggest one follow-up question if there are any uncertainties.
-Do NOT recalculate or modify any nutritional values - they are final.
-
-Respond with ONLY a JSON object:
-{{
-  "explanation": "brief explanation of assumptions",
-  "follow_up_question": "optional question for user"
-}}
-"""
+        explanation_prompt = _EXPLANATION_PROMPT_TEMPLATE % json.dumps(breakdown_items, separators=(',', ':'))
 
         try:
-            # Always route through run_with_tools for consistent error handling
-            explanation_response, explanation_tools = run_with_tools(chat_session, available_tools or {}, explanation_prompt)
+            # The same explanation turn on the same history reuses the earlier response (opt-in)
+            history_signature = compute_history_signature(chat_session.history) if REFINE_CACHE_ENABLED else None
+            cached_explanation = get_cached_refinement(explanation_prompt, history_signature, kind="explanation") if history_signature else None
+
+            if cached_explanation:
+                explanation_response, explanation_tools = cached_explanation, 0
+                # Record the turn so later turns see the same conversation as after a live call
+                chat_session.history = list(chat_session.history) + [
+                    {"role": "user", "parts": [explanation_prompt]},
+                    {"role": "model", "parts": [explanation_response]},
+                ]
+            else:
+                # Always route through run_with_tools for consistent error handling
+                explanation_response, explanation_tools = run_with_tools(chat_session, available_tools or {}, explanation_prompt)
             tool_calls_count += explanation_tools
 
             # Parse the explanation with proper schema validation
@@ -1129,14 +1425,18 @@ Respond with ONLY a JSON object:
                 final_json_data["explanation"] = parsed_explanation.explanation
                 final_json_data["follow_up_question"] = parsed_explanation.follow_up_question
 
-            return json.dumps(final_json_data), tool_calls_count
+                # Tool-free turns only: a cache hit replays them as a plain user/model exchange
+                if history_signature and not cached_explanation and explanation_tools == 0:
+                    cache_refinement(explanation_prompt, history_signature, explanation_response, kind="explanation")
+
+            return json.dumps(final_json_data, separators=(',', ':')), tool_calls_count
 
         except Exception as e:
             print(f"Error getting LLM explanation: {e}")
             # Add empty explanation on error
             final_json_data["explanation"] = ""
             final_json_data["follow_up_question"] = ""
-            return json.dumps(final_json_data), tool_calls_count
+            return json.dumps(final_json_data, separators=(',', ':')), tool_calls_count
 
     except Exception as e:
         print(f"Error in deterministic final calculation: {e}")
@@ -0,0 +1,108 @@
+"""
+Refinement cache: Reuses Stage-1 refinement responses for identical conversation turns.
+
+A refinement turn is fully determined by the chat history it is sent on (the seeded QA
+prompt plus earlier turns) and the per-turn prompt (vision context + user answers). When
+the same turn is sent again, e.g. the same meal re-analyzed (the vision cache makes the
+context identical) with the same answers, the earlier LLM response is reused. The final
+explanation turn is cached the same way under its own kind ("explanation"), so the two
+caches have separate key prefixes and hit metrics.
+
+Disabled unless NUTRIAI_REFINE_CACHE=1.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+from .cache_interface import get_cache_backend, build_cache_key, DEFAULT_TTL
+from config.model_config import MODEL_NAME, PROMPT_VERSION
+
+
+REFINE_CACHE_ENABLED = os.getenv("NUTRIAI_REFINE_CACHE", "0") == "1"
+
+# Cache backend (local or Redis based on env)
+_cache_backend = get_cache_backend()
+
+# TTL for refinement responses (24 hours)
+REFINE_TTL = DEFAULT_TTL["default"]
+
+
+def compute_history_signature(history: Any) -> Optional[str]:
+    """
+    Compute a short hash of the chat history a refinement turn is sent on.
+
+    Args:
+        history: chat_session.history (Content objects or {"role", "parts"} dicts)
+
+    Returns:
+        Hex digest prefix, or None if the history is not a readable list (turn is not cached)
+    """
+    if not isinstance(history, list):
+        return None
+
+    hasher = hashlib.sha256()
+    for content in history:
+        if isinstance(content, dict):
+            role, parts = content.get("role", ""), content.get("parts", [])
+        else:
+            role, parts = getattr(content, "role", ""), getattr(content, "parts", [])
+        hasher.update(f"{role}\x1e".encode())
+        for part in parts:
+            # Non-text parts (tool calls, images) fall back to their full repr
+            hasher.update((part if isinstance(part, str) else str(part)).encode())
+            hasher.update(b"\x1f")
+
+    return hasher.hexdigest()[:16]
+
+
+def _refine_cache_key(prompt: str, history_signature: str, kind: str) -> str:
+    """Build the versioned cache key for a prompt of the given kind sent on a given history."""
+    return build_cache_key(
+        prefix=kind,
+        model_name=MODEL_NAME,
+        prompt_version=PROMPT_VERSION,
+        history=history_signature,
+        prompt=hashlib.sha256(prompt.encode()).hexdigest()[:16]
+    )
+
+
+def get_cached_refinement(prompt: str, history_signature: str, kind: str = "refine") -> Optional[str]:
+    """
+    Retrieve the LLM response previously returned for this refinement turn.
+
+    Args:
+        prompt: Per-turn refinement prompt sent to the chat session
+        history_signature: compute_history_signature() of the history before the turn
+        kind: Turn kind ("refine" or "explanation"); sets the key prefix and hit event
+
+    Returns:
+        Raw response text or None if not cached
+    """
+    cached = _cache_backend.get(_refine_cache_key(prompt, history_signature, kind))
+
+    if cached and cached.get("response_text"):
+        print(f"METRICS: {json.dumps({'event': f'{kind}_cache_hit', 'history': history_signature[:8]})}")
+        return cached["response_text"]
+
+    return None
+
+
+def cache_refinement(prompt: str, history_signature: str, response_text: str, kind: str = "refine") -> None:
+    """
+    Cache an LLM refinement response that parsed without repair retries.
+
+    Args:
+        prompt: Per-turn refinement prompt sent to the chat session
+        history_signature: compute_history_signature() of the history before the turn
+        response_text: Raw LLM response text
+        kind: Turn kind ("refine" or "explanation"); sets the key prefix
+    """
+    try:
+        _cache_backend.set(
+            _refine_cache_key(prompt, history_signature, kind),
+            {"response_text": response_text},
+            ttl=REFINE_TTL
+        )
+    except Exception as e:
+        print(f"WARNING: Failed to cache refinement: {e}")
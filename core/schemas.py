@@ -2,6 +2,10 @@ from pydantic import BaseModel, Field, ConfigDict, model_validator
 from typing import Literal
 
 
+# Ingredient sources allowed to carry an explicit gram amount
+_AMOUNT_SOURCES = frozenset({"user", "vision", "portion-resolver"})
+
+
 class Ingredient(BaseModel):
     model_config = ConfigDict(extra='forbid', strict=True)
 
@@ -26,13 +30,12 @@ class Ingredient(BaseModel):
         - If amount is set, source must be 'user' or 'vision' or 'portion-resolver'
         - If amount is None, portion_label should be present (soft check)
         """
-        # If amount is set, source must be user/vision/portion-resolver
-        if self.amount is not None and self.amount > 0:
-            if self.source not in ("user", "vision", "portion-resolver"):
-                raise ValueError(
-                    f"Ingredient '{self.name}': amount can only be set if source is 'user', 'vision', or 'portion-resolver'. "
-                    f"Got source='{self.source}', amount={self.amount}. Set amount=None and use portion_label instead."
-                )
+        # If amount is set, source must be user/vision/portion-resolver (amount is >= 0, so truthy means > 0)
+        if self.amount and self.source not in _AMOUNT_SOURCES:
+            raise ValueError(
+                f"Ingredient '{self.name}': amount can only be set if source is 'user', 'vision', or 'portion-resolver'. "
+                f"Got source='{self.source}', amount={self.amount}. Set amount=None and use portion_label instead."
+            )
         return self
 
 
@@ -0,0 +1,79 @@
+"""
+Stage-2 parse cache: Reuses LLM parses of free-form Stage-2 adjustment chunks.
+
+A chunk that the deterministic parser could not handle is sent to the LLM together with
+the current portions. If the same (already normalized) chunk is seen again against the
+same portions, the earlier parsed edit is reused instead of calling the LLM again.
+"""
+import hashlib
+import json
+from typing import Optional
+
+from .cache_interface import get_cache_backend, build_cache_key, DEFAULT_TTL
+from config.model_config import MODEL_NAME, PROMPT_VERSION
+
+
+# Cache backend (local or Redis based on env)
+_cache_backend = get_cache_backend()
+
+# TTL for Stage-2 parses (24 hours)
+STAGE2_TTL = DEFAULT_TTL["default"]
+
+
+def compute_portions_signature(portions_json: str) -> str:
+    """
+    Compute a short hash of the portions table shown to the LLM.
+
+    Args:
+        portions_json: Serialized [{name, portion_label}, ...] list from the prompt
+
+    Returns:
+        Hex digest prefix identifying the portions context
+    """
+    return hashlib.sha256(portions_json.encode()).hexdigest()[:16]
+
+
+def _stage2_cache_key(chunk: str, portions_signature: str) -> str:
+    """Build the versioned cache key for a chunk parsed against a portions context."""
+    return build_cache_key(
+        prefix="stage2_parse",
+        model_name=MODEL_NAME,
+        prompt_version=PROMPT_VERSION,
+        portions=portions_signature,
+        chunk=hashlib.sha256(chunk.encode()).hexdigest()[:16]
+    )
+
+
+def get_cached_stage2_edit(chunk: str, portions_signature: str) -> Optional[dict]:
+    """
+    Retrieve a previously parsed edit for this chunk and portions context.
+
+    Args:
+        chunk: Normalized unparsed chunk from _deterministic_parse_stage2
+        portions_signature: compute_portions_signature() of the current portions
+
+    Returns:
+        Edit dict or None if not cached
+    """
+    cached_edit = _cache_backend.get(_stage2_cache_key(chunk, portions_signature))
+
+    if cached_edit:
+        print(f"METRICS: {json.dumps({'event': 'stage2_cache_hit', 'portions': portions_signature[:8]})}")
+        return cached_edit
+
+    return None
+
+
+def cache_stage2_edit(chunk: str, portions_signature: str, edit: dict) -> None:
+    """
+    Cache an LLM-parsed edit that matched a current ingredient for future reuse.
+
+    Args:
+        chunk: Normalized unparsed chunk from _deterministic_parse_stage2
+        portions_signature: compute_portions_signature() of the current portions
+        edit: Edit dict produced from the LLM reply (its item_head matched an ingredient)
+    """
+    try:
+        _cache_backend.set(_stage2_cache_key(chunk, portions_signature), edit, ttl=STAGE2_TTL)
+    except Exception as e:
+        print(f"WARNING: Failed to cache Stage-2 edit: {e}")
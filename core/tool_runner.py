@@ -3,6 +3,7 @@ from typing import Any, Callable, Dict, List, Tuple, Union
 import google.generativeai as genai
 import sys
 import os
+import threading
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.model_config import GENERATION_CONFIG
 
@@ -10,6 +11,22 @@ from config.model_config import GENERATION_CONFIG
 # Safety cap to prevent infinite tool-call loops
 MAX_ROUNDS = 8
 
+# Proto classes used to batch tool results back to the model
+_Part = genai.protos.Part
+_FunctionResponse = genai.protos.FunctionResponse
+
+# Process-wide cap on in-flight Gemini requests. Streamlit serves each session on its own
+# thread and grounding fans out over a thread pool, so without a bound a burst of users
+# can exceed the provider's rate limits.
+LLM_CONCURRENCY = int(os.getenv("NUTRIAI_LLM_CONCURRENCY", "8"))
+_llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+
+
+def _send_message(chat: genai.ChatSession, content: Any):
+    """Send a chat message while holding one of the LLM_CONCURRENCY request slots."""
+    with _llm_slots:
+        return chat.send_message(content)
+
 
 def llm_tiebreak(query: str, candidates: list[dict]) -> int:
     """
@@ -56,7 +73,8 @@ Respond with ONLY a JSON object: {{"pick": 0}}"""
             generation_config=GENERATION_CONFIG
         )
 
-        response = model.generate_content(prompt)
+        with _llm_slots:
+            response = model.generate_content(prompt)
 
         # Extract JSON from response
         result_text = ""
@@ -87,17 +105,82 @@ Respond with ONLY a JSON object: {{"pick": 0}}"""
         return 0
 
 
+# Leaf types that a JSON encode/decode round trip returns unchanged
+_JSON_LEAF_TYPES = (str, int, float, bool, type(None))
+
+
+def _sanitize_json_value(obj: Any) -> Any:
+    """
+    Copy obj into JSON-native types in one walk, matching json.loads(json.dumps(obj, default=str)).
+
+    Tuples become lists, int/float/bool/None dict keys become their JSON key strings, and
+    any other value (set, bytes, custom objects) becomes str(obj). Other key types raise
+    TypeError, as json.dumps does.
+    """
+    obj_type = type(obj)
+    if obj_type in _JSON_LEAF_TYPES:
+        return obj
+    if isinstance(obj, dict):
+        sanitized = {}
+        for key, value in obj.items():
+            if type(key) is not str:
+                if not isinstance(key, _JSON_LEAF_TYPES):
+                    raise TypeError(f"keys must be str, int, float, bool or None, not {type(key).__name__}")
+                key = json.dumps(key) if not isinstance(key, str) else str.__str__(key)
+            sanitized[key] = _sanitize_json_value(value)
+        return sanitized
+    if isinstance(obj, (list, tuple)):
+        return [_sanitize_json_value(item) for item in obj]
+    if isinstance(obj, _JSON_LEAF_TYPES):
+        # Subclasses (IntEnum, str mixins, ...) encode as their base value
+        return json.loads(json.dumps(obj))
+    return str(obj)
+
+
 def _jsonify_for_function_response(obj: Any) -> Any:
     """
     Ensure tool results are JSON-serializable before sending back to model.
     Handles non-serializable types (set, bytes, custom objects).
     """
     try:
-        return json.loads(json.dumps(obj, default=str))
+        return _sanitize_json_value(obj)
     except Exception:
         return {"content": str(obj)}
 
 
+def _scan_response_parts(resp: Any) -> Tuple[List[Any], Any, str]:
+    """
+    Walk the candidate parts of a Gemini response once.
+
+    Args:
+        resp: Gemini response
+
+    Returns:
+        Tuple of (function_calls, first JSON part value or None, first non-blank text part or "")
+    """
+    function_calls = []
+    json_value = None
+    text = ""
+    for candidate in resp.candidates:
+        content = getattr(candidate, 'content', None)
+        candidate_parts = content.parts if content else None
+        if not candidate_parts:
+            continue
+        for part in candidate_parts:
+            function_call = getattr(part, 'function_call', None)
+            if function_call:
+                function_calls.append(function_call)
+            if json_value is None:
+                part_json = getattr(part, 'json', None)
+                if part_json:
+                    json_value = part_json
+            if not text:
+                part_text = getattr(part, 'text', None)
+                if part_text and part_text.strip():
+                    text = part_text
+    return function_calls, json_value, text
+
+
 def run_with_tools(
     chat: genai.ChatSession,
     available_tools: Dict[str, Callable[..., Any]],
@@ -135,34 +218,24 @@ def run_with_tools(
         # Config not readable - this is normal after start_chat() in some SDK versions
         pass
 
-    resp = chat.send_message(user_msg)
+    resp = _send_message(chat, user_msg)
     tool_calls_count = 0
     rounds = 0
 
     # Handle tool calls in a loop until we get regular content
     while True:
         rounds += 1
+        # Extract function calls and candidate JSON/text in one pass over the parts
+        function_calls, json_value, part_text = _scan_response_parts(resp)
+
         if rounds > MAX_ROUNDS:
             print("WARNING: Max tool-call rounds reached; returning best-effort content.")
-            # Extract best-effort content from current response
-            parts = []
-            for candidate in resp.candidates:
-                if hasattr(candidate, 'content') and candidate.content and candidate.content.parts:
-                    parts.extend(candidate.content.parts)
-
-            # JSON-first extraction (same as normal path)
-            final_text = ""
-            for part in parts:
-                if hasattr(part, 'json') and part.json:
-                    final_text = json.dumps(part.json)
-                    break
+            # Best-effort content from the current response, JSON-first (same as normal path)
+            final_text = json.dumps(json_value) if json_value is not None else ""
 
             # Fallback to text if no JSON
             if not final_text or final_text.strip() == "":
-                for part in parts:
-                    if hasattr(part, 'text') and part.text and part.text.strip():
-                        final_text = part.text
-                        break
+                final_text = part_text
 
             # Final fallback for max rounds - still raise error instead of silent {}
             if not final_text or final_text.strip() == "":
@@ -174,28 +247,12 @@ def run_with_tools(
                 )
 
             return final_text, tool_calls_count
-        # Extract all parts from the response
-        parts = []
-        for candidate in resp.candidates:
-            if hasattr(candidate, 'content') and candidate.content and candidate.content.parts:
-                parts.extend(candidate.content.parts)
-
-        # Check for function calls
-        function_calls = []
-        for part in parts:
-            if hasattr(part, 'function_call') and part.function_call:
-                function_calls.append(part.function_call)
 
         if not function_calls:
             # No more function calls, extract final content
-            final_text = ""
-
             # ALWAYS prefer JSON parts over text extraction (JSON-first policy)
             # This ensures structured responses are properly extracted
-            for part in parts:
-                if hasattr(part, 'json') and part.json:
-                    final_text = json.dumps(part.json)
-                    break
+            final_text = json.dumps(json_value) if json_value is not None else ""
 
             # Fallback to text only if no JSON part exists
             if not final_text or final_text.strip() == "":
@@ -203,10 +260,7 @@ def run_with_tools(
                     final_text = resp.text
                 except Exception:
                     # resp.text failed (finish_reason=1, no valid Part, etc.)
-                    for part in parts:
-                        if hasattr(part, 'text') and part.text and part.text.strip():
-                            final_text = part.text
-                            break
+                    final_text = part_text
 
             # If still empty, DON'T silently fall back - this is an error condition
             if not final_text or final_text.strip() == "":
@@ -219,8 +273,8 @@ def run_with_tools(
 
             return final_text, tool_calls_count
 
-        # Execute all function calls and batch responses
-        responses = []
+        # Execute all function calls, then batch their responses
+        tool_results = []
         for call in function_calls:
             tool_name = call.name
             tool_args = dict(call.args)  # Convert from Gemini's args format
@@ -245,17 +299,16 @@ def run_with_tools(
             if isinstance(tool_result, list):
                 tool_result = {"results": tool_result}
 
-            # Add to batch of responses
-            responses.append(genai.protos.Part(
-                function_response=genai.protos.FunctionResponse(
-                    name=tool_name,
-                    response=tool_result
-                )
-            ))
+            tool_results.append((tool_name, tool_result))
+
+        responses = [
+            _Part(function_response=_FunctionResponse(name=tool_name, response=tool_result))
+            for tool_name, tool_result in tool_results
+        ]
 
         # Send all tool responses back in a single message (reduces round-trips)
         try:
-            resp = chat.send_message(responses)
+            resp = _send_message(chat, responses)
         except Exception as e:
             print(f"Batch tool response error: {e}")
             # Fallback: send as JSON-ish text
@@ -265,7 +318,7 @@ def run_with_tools(
                     for resp_part in responses
                 }
             }
-            resp = chat.send_message(json.dumps(fallback_data, default=str))
+            resp = _send_message(chat, json.dumps(fallback_data, default=str))
 
 
 def run_with_tools_and_parse(chat: genai.ChatSession, available_tools: dict, user_msg: str | list,
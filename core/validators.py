@@ -285,6 +285,11 @@ def validate_category_sanity_bands(scaled_items: List[ScaledItem]) -> List[str]:
     return warnings
 
 
+# Compound dishes and the note words that suggest their components were described separately
+_COMPOUND_KEYWORDS = ('smoothie', 'shake', 'protein shake', 'salad', 'sandwich', 'wrap', 'burrito', 'bowl')
+_COMPONENT_NOTE_KEYWORDS = ('protein powder', 'whey', 'casein', 'base', 'milk', 'with')
+
+
 def validate_composition_consistency(ingredients_raw: List[Dict[str, Any]]) -> List[str]:
     """
     Validate that compound items are properly decomposed when component notes exist.
@@ -299,7 +304,6 @@ def validate_composition_consistency(ingredients_raw: List[Dict[str, Any]]) -> L
         List of warning strings
     """
     warnings = []
-    compound_keywords = ['smoothie', 'shake', 'protein shake', 'salad', 'sandwich', 'wrap', 'burrito', 'bowl']
 
     for ingredient in ingredients_raw:
         name_lower = ingredient.get('name', '').lower()
@@ -307,8 +311,8 @@ def validate_composition_consistency(ingredients_raw: List[Dict[str, Any]]) -> L
         notes_lower = notes.lower()
 
         # Check if this is a compound item that should have been decomposed
-        is_compound = any(kw in name_lower for kw in compound_keywords)
-        has_component_notes = any(word in notes_lower for word in ['protein powder', 'whey', 'casein', 'base', 'milk', 'with'])
+        is_compound = any(kw in name_lower for kw in _COMPOUND_KEYWORDS)
+        has_component_notes = any(word in notes_lower for word in _COMPONENT_NOTE_KEYWORDS)
 
         if is_compound and has_component_notes:
             warnings.append(f"Compound item '{ingredient.get('name')}' with component notes ('{notes}') was not decomposed - may have inaccurate macros")
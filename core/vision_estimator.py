@@ -1,7 +1,7 @@
 import google.generativeai as genai
 from typing import List
 from .schemas import VisionEstimate
-from .json_repair import parse_or_repair_json, llm_retry_with_system_hardener
+from .json_repair import parse_or_repair_json, parse_or_repair_json_with_dict, llm_retry_with_system_hardener
 from .tool_runner import run_with_tools
 from .image_io import get_image_part
 from .vision_cache import get_cached_vision_output, cache_vision_output
@@ -132,7 +132,7 @@ def estimate(image_bytes: bytes, model: genai.GenerativeModel, available_tools:
         response_text, tool_calls_count = run_with_tools(chat, available_tools or {}, [prompt, image])
 
         # Parse and validate response
-        parsed_estimate, errors = parse_or_repair_json(response_text, VisionEstimate)
+        parsed_estimate, errors, raw_data = parse_or_repair_json_with_dict(response_text, VisionEstimate)
 
         if parsed_estimate is None and errors:
             # Attempt retry with hardener
@@ -160,11 +160,8 @@ Please retry the request and provide ONLY the JSON response.
 
         # Store raw model response for debugging
         if parsed_estimate:
-            try:
-                import json
-                parsed_estimate.raw_model = json.loads(response_text)
-            except:
-                parsed_estimate.raw_model = {"raw_text": response_text}
+            # Reuse the data decoded from the first response instead of parsing it again
+            parsed_estimate.raw_model = raw_data if isinstance(raw_data, dict) else {"raw_text": response_text}
 
             # Assign stable IDs to ingredients if not present
             import uuid
@@ -2,6 +2,7 @@ import pytest
 import json
 import tempfile
 import os
+import time
 from unittest.mock import Mock, patch, MagicMock
 
 # Import modules to test
@@ -150,6 +151,22 @@ class TestNutritionLookup:
         assert result["per100g"]["protein_g"] == 0.0
         assert tool_calls == 0  # No search function provided
 
+    @patch.object(nutrition_lookup, 'normalize_and_ground')
+    def test_ground_ingredients_list_keeps_order(self, mock_ground):
+        """Test concurrent grounding returns items in input order and skips unnamed ones."""
+        def slow_first(name, search_fn=None):
+            if name == "rice":
+                time.sleep(0.05)
+            return {"name": name, "source": "USDA"}, 1
+
+        mock_ground.side_effect = slow_first
+        ingredients = [{"name": "rice"}, {"amount": 10}, {"name": "dal"}, {"name": "ghee"}]
+
+        grounded, tool_calls = nutrition_lookup.ground_ingredients_list(ingredients)
+
+        assert [item["name"] for item in grounded] == ["rice", "dal", "ghee"]
+        assert tool_calls == 3
+
     def test_scale_item(self):
         """Test portion scaling."""
         grounded_item = nutrition_lookup.GroundedItem(
@@ -426,6 +443,123 @@ class TestQAManagerDeterministic:
                 called_ingredients = mock_breakdown.call_args[0][0]
                 assert any(ing["name"] == "chicken breast" and ing["amount"] == 165 for ing in called_ingredients)
 
+    @patch('core.qa_manager.run_with_tools')
+    def test_refine_empty_answers_skips_llm(self, mock_run_with_tools):
+        """Test that skipping every question returns a no-change update without an LLM call."""
+        from core.qa_manager import refine
+
+        refinement, tool_calls = refine(context="{}", user_input={}, chat_session=Mock())
+
+        assert refinement.updated_ingredients == []
+        assert refinement.updated_assumptions == []
+        assert tool_calls == 0
+        mock_run_with_tools.assert_not_called()
+
+    @patch('core.qa_manager.run_with_tools')
+    def test_refine_default_answers_reach_llm(self, mock_run_with_tools):
+        """Test that confirming a default (e.g. ghee_used=yes) is still sent to the LLM, which adds the ghee row."""
+        from core.qa_manager import refine
+
+        response = {
+            "updated_ingredients": [{"name": "ghee", "amount": 10, "unit": "g", "source": "user"}],
+            "updated_assumptions": []
+        }
+        mock_run_with_tools.return_value = (json.dumps(response), 0)
+
+        refinement, _ = refine(context="{}", user_input={"ghee_used": "yes"}, chat_session=Mock())
+
+        mock_run_with_tools.assert_called_once()
+        assert '"ghee_used":"yes"' in mock_run_with_tools.call_args[0][2]
+        assert [ing.name for ing in refinement.updated_ingredients] == ["ghee"]
+
+    @patch('core.qa_manager.run_with_tools')
+    def test_refine_seeds_qa_prompt_once(self, mock_run_with_tools):
+        """Test a real chat session gets the QA prompt and a neutral acknowledgement seeded exactly once."""
+        import google.generativeai as genai
+        from core.qa_manager import init_chat_session, load_qa_prompt, refine
+
+        chat = genai.GenerativeModel("gemini-2.5-flash-lite").start_chat()
+        init_chat_session(chat)
+        mock_run_with_tools.return_value = ('{"updated_ingredients": [], "updated_assumptions": []}', 0)
+        refine(context="{}", user_input={"oil": "none"}, chat_session=chat)
+        refine(context="{}", user_input={"oil": "butter"}, chat_session=chat)
+
+        assert [content.role for content in chat.history] == ["user", "model"]
+        assert chat.history[0].parts[0].text == load_qa_prompt()
+        ack = chat.history[1].parts[0].text
+        assert "updated_ingredients" not in ack
+        assert not hasattr(chat, "_qa_prompt_seeded")
+
+    @patch('core.qa_manager.run_with_tools')
+    def test_refine_keeps_decoded_raw_model(self, mock_run_with_tools):
+        """Test raw_model holds the decoded response, or the raw text when it needed repair."""
+        from core.qa_manager import refine
+
+        response = {"updated_ingredients": [], "updated_assumptions": [{"key": "oil", "value": "none", "confidence": 0.9}]}
+        mock_run_with_tools.return_value = (json.dumps(response), 0)
+        refinement, _ = refine(context="{}", user_input={"oil": "none"}, chat_session=Mock())
+        assert refinement.raw_model == response
+
+        fenced = "```json\n" + json.dumps(response) + "\n```"
+        mock_run_with_tools.return_value = (fenced, 0)
+        refinement, _ = refine(context="{}", user_input={"oil": "none"}, chat_session=Mock())
+        assert refinement.raw_model == {"raw_text": fenced}
+
+    @patch('core.qa_manager.run_with_tools')
+    def test_refine_cache_reuses_identical_turn(self, mock_run_with_tools, tmp_path):
+        """Test an identical turn on the same history is served from the refinement cache."""
+        from core.cache_interface import LocalFileCache
+        from core.qa_manager import refine
+
+        response = {"updated_ingredients": [], "updated_assumptions": [{"key": "oil", "value": "none", "confidence": 0.9}]}
+        mock_run_with_tools.return_value = (json.dumps(response), 0)
+
+        with patch('core.qa_manager.REFINE_CACHE_ENABLED', True), \
+                patch('core.refine_cache._cache_backend', LocalFileCache(cache_dir=str(tmp_path))):
+            first_chat, second_chat = Mock(history=[]), Mock(history=[])
+            first, _ = refine(context="{}", user_input={"oil": "none"}, chat_session=first_chat)
+            second, tool_calls = refine(context="{}", user_input={"oil": "none"}, chat_session=second_chat)
+
+            # The cached turn is recorded after the seeded QA prompt, so the next turn on this
+            # chat has a different history
+            assert len(second_chat.history) == 4
+            refine(context="{}", user_input={"oil": "none"}, chat_session=second_chat)
+
+        assert mock_run_with_tools.call_count == 2
+        assert tool_calls == 0
+        assert second.raw_model == first.raw_model == response
+
+    @patch('core.qa_manager.run_all_validations')
+    @patch('core.qa_manager.build_deterministic_breakdown')
+    @patch('core.qa_manager.run_with_tools')
+    def test_explanation_cache_reuses_identical_turn(self, mock_run_with_tools, mock_breakdown, mock_validations, tmp_path, capsys):
+        """Test the final explanation turn is served from the cache for the same breakdown and history."""
+        from core.cache_interface import LocalFileCache
+
+        mock_breakdown.return_value = ({
+            "items": [{"name": "chicken breast", "kcal": 272, "protein_g": 51, "carb_g": 0, "fat_g": 6}],
+            "attribution": []
+        }, 0)
+        mock_validations.return_value = {"four_four_nine": {"ok": True}, "portion_warnings": []}
+        explanation = {"explanation": "Grilled, no oil", "follow_up_question": ""}
+        mock_run_with_tools.return_value = (json.dumps(explanation), 0)
+        vision_estimate = Mock(ingredients=[{"name": "chicken breast", "amount": 165}])
+        stage2_answer = {"qty_confirm": "looks right"}
+
+        with patch('core.qa_manager.REFINE_CACHE_ENABLED', True), \
+                patch('core.refine_cache._cache_backend', LocalFileCache(cache_dir=str(tmp_path))):
+            first, _ = generate_final_calculation(Mock(history=[]), None, vision_estimate, [], stage2_answer)
+            second_chat = Mock(history=[])
+            second, _ = generate_final_calculation(second_chat, None, vision_estimate, [], stage2_answer)
+
+        mock_run_with_tools.assert_called_once()
+        assert len(second_chat.history) == 2
+        # Explanation hits are measured separately from refinement hits
+        out = capsys.readouterr().out
+        assert '"event": "explanation_cache_hit"' in out
+        assert "refine_cache_hit" not in out
+        assert json.loads(second)["explanation"] == json.loads(first)["explanation"] == "Grilled, no oil"
+
 
 def test_integration_no_regressions():
     """Integration test to ensure Phase 1 UX is preserved."""
@@ -0,0 +1,284 @@
+"""
+Unit tests for Stage-2 quantity verification in the QA manager.
+
+Covers the deterministic answer parser used before any LLM fallback and the
+matcher that maps parsed edits back onto ingredients.
+"""
+import json
+import pytest
+from unittest.mock import Mock, patch
+
+from core.cache_interface import LocalFileCache
+from core.qa_manager import (
+    _deterministic_parse_stage2,
+    _safe_match_ingredient,
+    apply_stage2_adjustments,
+    generate_stage2_question,
+    should_trigger_stage2
+)
+
+
+class TestDeterministicParseStage2:
+    """Test regex/lexicon parsing of Stage-2 answers."""
+
+    def test_size_before_item(self):
+        """Test '<size> <item>' sets the portion label."""
+        edits = _deterministic_parse_stage2("large fries")
+        assert edits == [{"action": "SET_PORTION_LABEL", "item_head": "fries", "value": "large", "ordinal": None}]
+
+    def test_variant_before_item(self):
+        """Test '<variant> <item>' sets the variant."""
+        edits = _deterministic_parse_stage2("diet cola")
+        assert edits == [{"action": "SET_VARIANT", "item_head": "cola", "variant": "diet", "ordinal": None}]
+
+    @pytest.mark.parametrize("text", ["2 cups rice", "rice 2 cups"])
+    def test_quantity_and_unit(self, text):
+        """Test quantity + unit in either order."""
+        edits = _deterministic_parse_stage2(text)
+        assert edits == [{"action": "SET_PORTION_LABEL", "item_head": "rice", "value": "2 cups", "ordinal": None}]
+
+    def test_synonyms_normalized(self):
+        """Test unit/size/variant synonyms are normalized before matching."""
+        edits = _deterministic_parse_stage2("12 ounces milk; xl fries; coke zero sugar")
+        assert edits[0]["value"] == "12 oz"
+        assert edits[1]["value"] == "x-large"
+        assert edits[2]["item_head"] == "coke"
+        assert edits[2]["variant"] == "diet"
+
+    def test_ordinal_extracted(self):
+        """Test ordinal markers are captured and stripped from the item."""
+        edits = _deterministic_parse_stage2("cola #2 diet and second fries large")
+        assert edits[0] == {"action": "SET_VARIANT", "item_head": "cola", "variant": "diet", "ordinal": 2}
+        assert edits[1]["item_head"] == "fries"
+        assert edits[1]["ordinal"] == 2
+
+    def test_unparsed_chunk(self):
+        """Test free text falls through for LLM parsing."""
+        edits = _deterministic_parse_stage2("something weird here")
+        assert edits == [{"action": "UNPARSED", "chunk": "something weird here"}]
+
+
+class TestShouldTriggerStage2:
+    """Test when the Stage-2 quantity check is shown."""
+
+    def test_branded_sized_meal_skips(self):
+        """Test branded + sized items (brand as a substring of notes) skip Stage-2."""
+        ingredients = [
+            {"name": "potato fries", "notes": "McDonald's", "portion_label": "medium"},
+            {"name": "cola", "notes": "McDonald's", "portion_label": "large"},
+        ]
+        assert should_trigger_stage2(ingredients) is False
+
+    def test_single_serve_beverage_skips(self):
+        """Test a lone beverage with a single-serve portion skips Stage-2."""
+        assert should_trigger_stage2([{"name": "milkshake", "portion_label": "1 bottle"}]) is False
+
+    def test_unbranded_meal_triggers(self):
+        """Test multi-item unbranded meals trigger Stage-2."""
+        ingredients = [
+            {"name": "basmati rice", "portion_label": "1 cup"},
+            {"name": "dal (yellow)", "portion_label": "1 cup"},
+        ]
+        assert should_trigger_stage2(ingredients) is True
+
+    def test_missing_portion_triggers(self):
+        """Test a single item without a portion label triggers Stage-2."""
+        assert should_trigger_stage2([{"name": "chicken biryani"}]) is True
+
+
+class TestSafeMatchIngredient:
+    """Test matching of edit item heads to ingredients."""
+
+    INGREDIENTS = [
+        {"name": "dal (yellow)"},
+        {"name": "daliya"},
+        {"name": "cola (diet)"},
+        {"name": "cola"},
+        {"name": "basmati rice"},
+    ]
+
+    def test_exact_head_no_substring_match(self):
+        """Test 'dal' matches dal, not daliya."""
+        match, score = _safe_match_ingredient("dal", self.INGREDIENTS)
+        assert match["name"] == "dal (yellow)"
+        assert score == 1.0
+
+    def test_head_term_of_multiword_name(self):
+        """Test head noun matching against multi-word names."""
+        match, _ = _safe_match_ingredient("rice", self.INGREDIENTS)
+        assert match["name"] == "basmati rice"
+
+    def test_ambiguous_match_returns_none(self):
+        """Test duplicate heads without an ordinal are not guessed."""
+        assert _safe_match_ingredient("cola", self.INGREDIENTS) == (None, 0.0)
+
+    def test_ordinal_disambiguates(self):
+        """Test ordinal picks the Nth same-head ingredient."""
+        match, _ = _safe_match_ingredient("cola", self.INGREDIENTS, ordinal=2)
+        assert match["name"] == "cola"
+
+    def test_ordinal_with_empty_head(self):
+        """Test an ordinal lookup tolerates ingredients whose head normalizes to nothing."""
+        ingredients = [{"name": ""}, {"name": ""}]
+        match, score = _safe_match_ingredient("", ingredients, ordinal=2)
+        assert match is ingredients[1]
+        assert score == 1.0
+
+    def test_no_match(self):
+        """Test unknown items return no match."""
+        assert _safe_match_ingredient("naan", self.INGREDIENTS) == (None, 0.0)
+
+
+class TestApplyStage2Adjustments:
+    """Test applying Stage-2 answers to ingredients."""
+
+    @pytest.fixture(autouse=True)
+    def _isolated_stage2_cache(self, tmp_path):
+        """Give each test an empty Stage-2 parse cache."""
+        with patch('core.stage2_cache._cache_backend', LocalFileCache(cache_dir=str(tmp_path))):
+            yield
+
+    @staticmethod
+    def _ingredients():
+        return [
+            {"name": "basmati rice", "portion_label": "1 cup"},
+            {"name": "dal (yellow)", "portion_label": "1 cup"},
+            {"name": "ghee", "portion_label": "1 tbsp"},
+        ]
+
+    def test_checksum_detects_stale_answer(self):
+        """Test answers are only applied to the ingredient list they were asked about."""
+        checksum = generate_stage2_question(self._ingredients())["checksum"]
+        assert len(checksum) == 8
+
+        fresh = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": "rice 2 cups", "checksum": checksum}, Mock(), {})
+        assert fresh["ok"]
+
+        changed = self._ingredients()[:2]
+        stale = apply_stage2_adjustments(changed, {"qty_confirm": "rice 2 cups", "checksum": checksum}, Mock(), {})
+        assert not stale["ok"]
+        assert stale["applied_count"] == 0
+
+    @pytest.mark.parametrize("answer", ["Looks right", "  OK ", "lgtm"])
+    def test_accept_phrases_leave_portions(self, answer):
+        """Test accepting answers return the ingredients unchanged without parsing."""
+        with patch('core.qa_manager._deterministic_parse_stage2') as mock_parse:
+            result = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        mock_parse.assert_not_called()
+        assert result["ok"]
+        assert result["applied_count"] == 0
+        assert result["ingredients"] == self._ingredients()
+
+    def test_deterministic_edits_skip_llm(self):
+        """Test regex-parsable answers never call the LLM."""
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools:
+            result = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": "rice 2 cups"}, Mock(), {})
+
+        mock_run_with_tools.assert_not_called()
+        assert result["ok"]
+        assert result["ingredients"][0]["portion_label"] == "2 cups"
+
+    def test_repeated_edits_applied_once(self):
+        """Test duplicate chunks are sent to the LLM once and duplicate edits applied once."""
+        answer = "a bit more of the rice than before; a bit more of the rice than before; ghee 2 tbsp; ghee 2 tbsp"
+        llm_reply = {"1": {"name": "rice", "new_portion_label": "1.5 cups"}}
+
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools:
+            mock_run_with_tools.return_value = (json.dumps(llm_reply), 0)
+            result = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        prompt = mock_run_with_tools.call_args[0][2]
+        assert "[1] a bit more of the rice than before" in prompt
+        assert "[2]" not in prompt
+        assert result["applied_count"] == 2
+        assert result["ingredients"][2]["portion_label"] == "2 tbsp"
+
+    def test_unparsed_chunks_batched_by_index(self):
+        """Test unparsed chunks go to the LLM as one indexed batch and are spliced back by index."""
+        answer = "a bit more of the rice than before; less ghee please; half of it"
+        llm_reply = {"1": {"name": "rice", "new_portion_label": "1.5 cups"},
+                     "2": {"name": "ghee", "new_portion_label": "0.5 tbsp"},
+                     "3": None}
+
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools:
+            mock_run_with_tools.return_value = (json.dumps(llm_reply), 0)
+            result = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        mock_run_with_tools.assert_called_once()
+        prompt = mock_run_with_tools.call_args[0][2]
+        assert "[1] a bit more of the rice than before" in prompt
+        assert "[3] half of it" in prompt
+
+        assert result["ok"]
+        assert result["applied_count"] == 2
+        portions = {ing["name"]: ing["portion_label"] for ing in result["ingredients"]}
+        assert portions == {"basmati rice": "1.5 cups", "dal (yellow)": "1 cup", "ghee": "0.5 tbsp"}
+
+    def test_repeat_chunks_reuse_cached_parse(self):
+        """Test a repeated phrasing against the same portions is served from the cache."""
+        answer = "a bit more of the rice than before please if that is possible"
+        llm_reply = {"1": {"name": "rice", "new_portion_label": "1.5 cups"}}
+
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools:
+            mock_run_with_tools.return_value = (json.dumps(llm_reply), 0)
+            first = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+            second = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        mock_run_with_tools.assert_called_once()
+        assert first["ingredients"] == second["ingredients"]
+        assert second["ingredients"][0]["portion_label"] == "1.5 cups"
+
+    def test_fenced_llm_reply_parsed(self):
+        """Test a code-fenced Stage-2 reply (tool-enabled sessions have no JSON mode) is still applied."""
+        answer = "a bit more of the rice than before please if that is possible"
+        llm_reply = {"1": {"name": "rice", "new_portion_label": "1.5 cups"}}
+
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools:
+            mock_run_with_tools.return_value = ("```json\n" + json.dumps(llm_reply) + "\n```", 0)
+            result = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        assert result["ok"]
+        assert result["ingredients"][0]["portion_label"] == "1.5 cups"
+
+    def test_unmatched_llm_reply_not_cached(self):
+        """Test an LLM reply naming no current ingredient is not reused for a repeated phrasing."""
+        answer = "a bit more of the naan than before please if that is possible"
+        llm_reply = {"1": {"name": "naan", "new_portion_label": "2 pieces"}}
+
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools:
+            mock_run_with_tools.return_value = (json.dumps(llm_reply), 0)
+            apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+            apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        assert mock_run_with_tools.call_count == 2
+
+    def test_empty_llm_reply_retried_with_backoff(self):
+        """Test an empty Stage-2 LLM reply is retried once after a backoff sleep."""
+        answer = "a bit more of the rice than before please if that is possible"
+        llm_reply = {"1": {"name": "rice", "new_portion_label": "1.5 cups"}}
+
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools, \
+                patch('core.qa_manager._backoff_sleep') as mock_sleep:
+            mock_run_with_tools.side_effect = [ValueError("LLM returned empty response"), (json.dumps(llm_reply), 0)]
+            result = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        assert mock_run_with_tools.call_count == 2
+        mock_sleep.assert_called_once_with(0, 0.1)
+        assert result["ingredients"][0]["portion_label"] == "1.5 cups"
+
+    def test_rate_limited_llm_call_retried_with_backoff(self):
+        """Test a provider rate-limit error on the Stage-2 LLM call is retried after a backoff sleep."""
+        from google.api_core.exceptions import ResourceExhausted
+
+        answer = "a bit more of the rice than before please if that is possible"
+        llm_reply = {"1": {"name": "rice", "new_portion_label": "1.5 cups"}}
+
+        with patch('core.qa_manager.run_with_tools') as mock_run_with_tools, \
+                patch('core.qa_manager._backoff_sleep') as mock_sleep:
+            mock_run_with_tools.side_effect = [ResourceExhausted("quota exceeded"), (json.dumps(llm_reply), 0)]
+            result = apply_stage2_adjustments(self._ingredients(), {"qty_confirm": answer}, Mock(), {})
+
+        assert mock_run_with_tools.call_count == 2
+        mock_sleep.assert_called_once_with(0, 0.1)
+        assert result["ingredients"][0]["portion_label"] == "1.5 cups"
@@ -324,6 +324,7 @@ def show_upload_page():
         # Create or reuse chat session for conversation persistence
         if "conversation_chat" not in st.session_state:
             st.session_state.conversation_chat = model.start_chat()
+            qa_manager.init_chat_session(st.session_state.conversation_chat)
         conversation_chat = st.session_state.conversation_chat
 
         # Only show additional clarifications if there are no structured questions